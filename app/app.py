@@ -1,15 +1,26 @@
-from flask import Flask, render_template, request, redirect, session, url_for, flash, abort, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, send_from_directory
 from flask_login import login_required, current_user
 from sqlalchemy import MetaData
+from sqlalchemy.orm import load_only, selectinload, joinedload
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import os
-from datetime import datetime, timedelta
+import click
+from contextlib import nullcontext
+from werkzeug.exceptions import RequestEntityTooLarge
+from routing import RoutingSession, replica_reads, no_sticky_writes
 
 app = Flask(__name__)
 application = app
 
-app.config.from_pyfile('config.py')
+# Для тестов путь к настройкам задается переменной APP_CONFIG
+app.config.from_pyfile(os.environ.get('APP_CONFIG', 'config.py'))
+# Запрос с обложкой больше MAX_IMAGE_SIZE (плюс место на остальные поля
+# формы) отклоняется по Content-Length, до приема и разбора тела
+if app.config.get('MAX_IMAGE_SIZE') and not app.config.get('MAX_CONTENT_LENGTH'):
+    app.config['MAX_CONTENT_LENGTH'] = (
+        app.config['MAX_IMAGE_SIZE']
+        + app.config.get('MAX_FORM_FIELDS_SIZE', 1024 * 1024))
 
 convention = {
     "ix": 'ix_%(column_0_label)s',
@@ -20,83 +31,168 @@ convention = {
 }
 
 metadata = MetaData(naming_convention=convention)
-db = SQLAlchemy(app, metadata=metadata)
+# Чтение отчетов и каталога может идти с реплики (bind "replica")
+db = SQLAlchemy(app, metadata=metadata,
+                session_options={'class_': RoutingSession})
 migrate = Migrate(app, db)
 
-from models import Book, Genre, Image, Review, BookVisits, LastBookVisits
+from models import Book, Review, User
+from users_policy import permission_matrix
 from auth import init_login_manager, check_rights, bp as auth_bp
 from reviews import bp as reviews_bp
 from logs import bp as logs_bp
+from visits import visit_writer
+from visit_cap import visit_cap
+from stats import top_books
+from loaders import book_loader
+from markup import render_markdown
+from pagination import KeysetPagination
 
 init_login_manager(app)
 
+# Таблица прав по ролям
+with app.app_context():
+    permission_matrix.compile(lambda role_id: User(role_id=role_id),
+                              [app.config['ADMIN_ROLE_ID'],
+                               app.config['MODERATOR_ROLE_ID'],
+                               app.config['USER_ROLE_ID']])
+
 app.register_blueprint(auth_bp)
 app.register_blueprint(reviews_bp)
 app.register_blueprint(logs_bp)
 
 
-# Функция для получнеия последних 5 книг
-# Функция нужна, для корректного отображения
-# для анонимных пользователей
+# Функция для получнеия последних 5 книг.
+# Для анонимных пользователей история берется из сессии
 def get_five_last_books():
-    # Если пользователь вошел в систему
-    if current_user.is_authenticated:
-        # Получаем последние 5 книг
-        last_books = (LastBookVisits.query
-                            .filter_by(user_id=current_user.id)
-                            .order_by(LastBookVisits.created_at.desc())
-                            .limit(5)
-                            .all())
-    else:
-        last_books = session.get("last_books")
-    result = []
-    if last_books:
-        if current_user.is_authenticated:
-            for book_log in last_books:
-                result.append(Book.query.get(book_log.book_id))
-        else:
-            for book_log in last_books:
-                result.append(Book.query.get(book_log))
-    return result
+    last_books = recent_book_ids(5)
+    if not last_books:
+        return []
+    # Все книги одним запросом, удаленные пропускаются
+    return book_loader().load_many(last_books)
+
+# Чтение каталога с реплики. Сразу после изменения каталога реплика
+# может отставать, а результат попадет в кеш фрагментов, поэтому
+# в это время читаем с основной базы
+def catalog_reads():
+    if fragment_cache.changed_within(
+            'catalog', app.config.get('REPLICA_STICKY_SECONDS', 5)):
+        return nullcontext()
+    return replica_reads()
 
 def get_top_five_books():
-    start_time = datetime.now() - timedelta(days=3 * 30)
-    top_five_books = (db.session
-                        .query(BookVisits.book_id, db.func.count(BookVisits.id))
-                        .filter(start_time <= BookVisits.created_at)
-                        .group_by(BookVisits.book_id)
-                        .order_by(db.func.count(BookVisits.id).desc())
-                        .limit(5).all())
-    result = []
-    for i, book_item in enumerate(top_five_books):
-        book = Book.query.get(top_five_books[i][0])
-        result.append((book, top_five_books[i][1]))
-    return result
+    # Считаем по посуточной сводке, а не по сырому журналу
+    with catalog_reads():
+        top_five_books = top_books.get(days=3 * 30, limit=5)
+        books = book_loader().load_many(
+            book_id for book_id, _ in top_five_books)
+    books = {book.id: book for book in books}
+    return [(books[book_id], count) for book_id, count in top_five_books
+            if book_id in books]
 
 @app.route('/')
 def index():
     last_books = get_five_last_books()
-    top_five_books = get_top_five_books()
+    # Популярные книги и страница каталога берутся из кеша фрагментов,
+    # недавно просмотренные у каждого пользователя свои
+    popular_html = fragment_cache.render(
+        'popular', render_popular_books, versions=['catalog'],
+        parts=[permission_bucket()],
+        ttl=app.config.get('TOP_BOOKS_CACHE_TTL', 60))
 
     page = request.args.get('page', 1, type=int)
-    books = Book.query.order_by(Book.id.desc())
-    pagination = books.paginate(page=page, per_page=app.config['PER_PAGE'])
-    books = pagination.items
-    if last_books == [None, None]:
-        last_books = []
-    return render_template("index.html", pagination=pagination, books=books,
-                           last_books = last_books,
-                           top_five_books = top_five_books)
-
+    cursor = request.args.get('cursor')
+    catalog_html = fragment_cache.render(
+        'catalog', lambda: render_catalog(page, cursor), versions=['catalog'],
+        parts=[permission_bucket(), page, cursor or ''])
+    return render_template("index.html",
+                           catalog_html=catalog_html,
+                           popular_html=popular_html,
+                           last_books = last_books)
+
+
+def render_popular_books():
+    return render_template('books/popular.html',
+                           top_five_books=get_top_five_books())
+
+
+def render_catalog(page, cursor):
+    # Первые страницы по номеру, дальше по курсору
+    # Все, что нужно шаблону каталога, загружаем сразу:
+    # жанры одним дополнительным запросом на страницу
+    with catalog_reads():
+        books = Book.query.options(
+            load_only(Book.id, Book.name, Book.year_release, Book.image_id,
+                      Book.short_desc, Book.short_desc_html,
+                      Book.rating_sum, Book.rating_num),
+            selectinload(Book.genres), joinedload(Book.image))
+        # Книги, которые удаляются в фоне, уже не показываются
+        books = books.filter(Book.purging.is_(False))
+        pagination = KeysetPagination(
+            books, [Book.id], app.config['PER_PAGE'],
+            page=page, cursor=cursor,
+            offset_pages=app.config.get('KEYSET_OFFSET_PAGES', 5),
+            count_key='books')
+        return render_template('books/catalog.html', pagination=pagination,
+                               books=pagination.items)
+
+# Обложки отдаются по адресу с md5 содержимого, поэтому ответ можно
+# кешировать навсегда. Метаданные берутся из кеша процесса
 @app.route('/images/<image_id>')
-def image(image_id):
-    img = Image.query.get(image_id)
-    if img is None:
+@app.route('/images/<image_id>/<md5_hash>')
+def image(image_id, md5_hash=None):
+    meta = image_meta.get(image_id)
+    if meta is None:
         abort(404)
-    return send_from_directory(app.config['UPLOAD_FOLDER'],
-                               img.file_name)
-
-from tool import ImageSaver
+    file_name, mime_type, digest = meta
+    if md5_hash is not None and md5_hash != digest:
+        return redirect(url_for('image', image_id=image_id, md5_hash=digest),
+                        code=301)
+    immutable = md5_hash is not None
+    # Уменьшенная копия (?size=thumb), если ее удалось получить
+    size = request.args.get('size')
+    if size in VARIANTS:
+        variant = thumbnails.ensure(file_name, size)
+        if variant is not None:
+            file_name = 'variants/' + os.path.basename(variant)
+            digest = '%s-%s' % (digest, size)
+        else:
+            immutable = False
+    max_age = (app.config.get('IMAGE_MAX_AGE', 365 * 24 * 60 * 60)
+               if immutable else app.config.get('IMAGE_LEGACY_MAX_AGE', 3600))
+    if digest in request.if_none_match:
+        response = app.response_class(status=304)
+    elif app.config.get('IMAGE_ACCEL_REDIRECT_PREFIX'):
+        # Передачу файла берет на себя фронтовой прокси (nginx)
+        response = app.response_class(mimetype=mime_type)
+        response.headers['X-Accel-Redirect'] = (
+            app.config['IMAGE_ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/'
+            + file_name)
+    else:
+        # При USE_X_SENDFILE Flask сам отдаст файл через X-Sendfile
+        response = send_from_directory(app.config['UPLOAD_FOLDER'],
+                                       file_name, mimetype=mime_type,
+                                       etag=digest, max_age=max_age)
+    response.set_etag(digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = immutable
+    return response
+
+from tool import ImageSaver, ImageTooLarge, image_meta
+from genres import genre_registry
+from purge import count_visits, delete_book, start_purge
+from search import search_index
+from fragments import (fragment_cache, book_version, bump_catalog,
+                       permission_bucket)
+from history import record_last_visit, recent_book_ids, remember_in_session
+from thumbnails import thumbnails, VARIANTS
+
+# Слишком большой запрос (обычно обложка) возвращает к форме
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    flash('Размер обложки превышает допустимый', 'danger')
+    return redirect(request.url)
 
 def extract_params(dict):
     return {p: request.form.get(p) for p in dict}
@@ -112,16 +208,18 @@ BOOKS_PARAMS = [
 def new():
     if request.method == "POST":
         f = request.files.get('background_img')
+        img = None
         if f and f.filename:
-            img = ImageSaver(f).save()
+            try:
+                img = ImageSaver(f).save()
+            except ImageTooLarge:
+                flash('Размер обложки превышает допустимый', 'danger')
+        if img:
             params = extract_params(BOOKS_PARAMS)
             params['year_release'] = int(params['year_release'])
             params['pages_volume'] = int(params['pages_volume'])
-            genres = request.form.getlist('genres')
-            genres_list = []
-            for i in genres:
-                genre = Genre.query.filter_by(id=i).first()
-                genres_list.append(genre)
+            # Жанры из справочника, без запроса на каждый жанр
+            genres_list = genre_registry.resolve(request.form.getlist('genres'))
 
             book = Book(**params, image_id=img.id)
             book.prepare_to_save()
@@ -129,6 +227,8 @@ def new():
             try:
                 db.session.add(book)
                 db.session.commit()
+                search_index.update(book)
+                bump_catalog()
                 flash('Книга успешно добавлена', 'success')
                 return redirect(url_for('index'))
             except:
@@ -144,7 +244,7 @@ def new():
     '''
     
     
-    genres = Genre.query.all()
+    genres = genre_registry.all()
     return render_template('books/create_edit.html',
                         action_category='create',
                         genres=genres,
@@ -155,27 +255,26 @@ def new():
 @login_required
 @check_rights('edit')
 def edit(book_id):
+    book = Book.query.get(book_id)
+    if book is None:
+        abort(404)
     if request.method == "POST":
         params = extract_params(BOOKS_PARAMS)
         params['year_release'] = int(params['year_release'])
         params['pages_volume'] = int(params['pages_volume'])
-        genres = request.form.getlist('genres')
-        genres_list = []
-        book = Book.query.get(book_id)
         book.name = params['name']
         book.author = params['author']
         book.publisher = params['publisher']
         book.year_release = params['year_release']
         book.pages_volume = params['pages_volume']
         book.short_desc = params['short_desc']
-
-        for i in genres:
-            genre = Genre.query.filter_by(id=i).first()
-            genres_list.append(genre)
-        book.genres = genres_list
+        book.prepare_to_save()
+        book.genres = genre_registry.resolve(request.form.getlist('genres'))
         try:
             db.session.add(book)
             db.session.commit()
+            search_index.update(book)
+            bump_catalog(book.id)
             flash('Книга успешно обновлена', 'success')
             return redirect(url_for('index'))
         except:
@@ -183,8 +282,7 @@ def edit(book_id):
 
         flash('При обновления данных возникла ошибка. Проверьте корректность введённых данных.', 'danger')
 
-    book = Book.query.get(book_id)
-    genres = Genre.query.all()
+    genres = genre_registry.all()
     return render_template('books/create_edit.html',
                            action_category='edit',
                            genres=genres,
@@ -197,115 +295,112 @@ def edit(book_id):
 @login_required
 @check_rights('delete')
 def delete(book_id):
-    book = Book.query.get(book_id)
-    # Проверка зависимости у обложки
-    references = len(Book.query.filter_by(image_id=book.image.id).all())
-       
+    book = db.session.get(Book, book_id)
+    if book is None:
+        abort(404)
     try:
-         # Удаление всех зависимостей
-        for item in BookVisits.query.filter_by(book_id=book_id):
-            db.session.delete(item)
-        for item in LastBookVisits.query.filter_by(book_id=book_id):
-            db.session.delete(item)
-        for item in Review.query.filter_by(book_id=book_id):
-            db.session.delete(item)
-
-        db.session.delete(book)
-        # Если зависимость единственная, то обложку можно удалить
-        if references == 1:
-            image = Image.query.get(book.image.id)
-            delete_path = os.path.join(
-                app.config['UPLOAD_FOLDER'],
-                image.file_name)
-            db.session.delete(image)
-            os.remove(delete_path)
-        db.session.commit()
-        flash('Удаление книги прошло успешно', 'success')
+        # Книгу с большим журналом просмотров удаляем в фоне порциями
+        if book.purging:
+            flash('Книга уже удаляется', 'warning')
+        elif count_visits(book_id) > app.config.get('PURGE_ASYNC_THRESHOLD',
+                                                    10000):
+            if start_purge(book_id) is None:
+                flash('Книга уже удаляется', 'warning')
+            else:
+                flash('Удаление книги запущено и завершится в фоне',
+                      'success')
+        else:
+            delete_book(book_id)
+            flash('Удаление книги прошло успешно', 'success')
     except:
-        db.session.rollback()
         flash('Во время удаления книги произошла ошибка', 'danger')
 
     return redirect(url_for('index'))
 
+# Сохранение HTML для книг и рецензий, созданных до его появления
+@app.cli.command('backfill-html')
+def backfill_html():
+    """Отрисовать markdown описаний книг и рецензий в HTML."""
+    for model, column in ((Book, Book.short_desc_html),
+                          (Review, Review.text_html)):
+        updated = 0
+        while True:
+            items = model.query.filter(column.is_(None)).limit(500).all()
+            if not items:
+                break
+            for item in items:
+                if model is Book:
+                    item.short_desc_html = render_markdown(item.short_desc)
+                else:
+                    item.text_html = render_markdown(item.text)
+            db.session.commit()
+            updated += len(items)
+        click.echo('%s: обновлено %d' % (model.__tablename__, updated))
+
+
 # Просмотр книги
 @app.route('/<int:book_id>')
 def show(book_id):
-    book = Book.query.get(book_id)
-    book.prepare_to_html()
-    # Получаем все рецензии
-    reviews = Review.query.filter_by(book_id=book_id)
-    # Каждую из рецензий подготавливаем для отображения
-    for review in reviews:
-        review.prepare_to_html()
+    loaded = {}
+
+    def render_details():
+        book = Book.query.get(book_id)
+        # Книга, которая удаляется в фоне, уже не показывается
+        if book is None or book.purging:
+            abort(404)
+        # Получаем все рецензии, HTML для них уже сохранен
+        reviews = (Review.query.options(joinedload(Review.user))
+                   .filter_by(book_id=book_id).all())
+        loaded['reviews'] = reviews
+        return render_template('books/details.html',
+                               book=book, reviews=reviews)
+
+    # Описание книги и рецензии кешируются до изменения книги
+    # или новой рецензии
+    book_html = fragment_cache.render('book', render_details,
+                                      versions=[book_version(book_id)])
     # Заглушка, т.к. у пользователя может не быть рецензии
     user_review = None
     # Если у пользователя есть идентификатор
     if current_user.get_id():
         # Извлекаем рецензии пользователя
-        user_review = reviews.filter_by(user_id=current_user.id).first()
-    # Получаем все рецензии
-    reviews.all()
+        if 'reviews' in loaded:
+            user_review = next((review for review in loaded['reviews']
+                                if review.user_id == current_user.id), None)
+        else:
+            user_review = (Review.query.options(joinedload(Review.user))
+                           .filter_by(book_id=book_id,
+                                      user_id=current_user.id).first())
     return render_template('books/show.html',
-                           book=book,
-                           reviews=reviews,
+                           book_id=book_id,
+                           book_html=book_html,
                            user_review=user_review)
 
 
+# Поиск по каталогу
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    books = []
+    if query:
+        ids = search_index.search(query, app.config.get('SEARCH_LIMIT', 50))
+        books = book_loader().load_many(ids)
+    return render_template('search.html', query=query, books=books)
+
+
 #  Создание логов для книги
 def creating_book_visits(user_id, book_id):
-    try:
-        visit_log_params = {
-            'user_id': user_id,
-            'book_id': book_id,
-        }
-        db.session.add(BookVisits(**visit_log_params))
-        db.session.commit()
-    except:
-        db.session.rollback()
+    with no_sticky_writes():
+        visit_writer.record(user_id, book_id)
 
 
 def creating_last_book_log(book_id, user_id):
-    new_log = None
-
-    # Извлекаем данные, когда пользователь последний раз получал доступ
-    book_log = (LastBookVisits.query
-                   # Фильтруем по конкретной книге
-                   .filter_by(book_id=book_id)  
-                   # Фильтруем по конкретному пользователю
-                   .filter_by(user_id=current_user.id) 
-                   .first())
-    if book_log:
-        # У найденой записи обновляем время доступа
-        book_log.created_at = db.func.now()
-    # Если пользователь еще не получал доступа к книге,
-    # то создаем новую запись
-    else:
-        new_log = LastBookVisits(book_id=book_id, user_id=user_id)
-   
-    # Если была создана запись
-    if new_log:
-        try:
-            db.session.add(new_log)
-            db.session.commit()
-        except:
-            db.session.rollback()
-
-
-def save_last_books(book_id):
-    data_from_cookies = session.get('last_books')
-
-    if data_from_cookies:
-        if book_id in data_from_cookies:
-            data_from_cookies.remove(book_id)
-            data_from_cookies.insert(0, book_id)
-        else:
-            data_from_cookies.insert(0, book_id)
-    
-    # Если логов ранее не было сохранено
-    if not data_from_cookies:
-        data_from_cookies = [book_id]
+    try:
+        with no_sticky_writes():
+            record_last_visit(user_id, book_id)
+    except:
+        db.session.rollback()
 
-    session['last_books'] = data_from_cookies
 
 @app.before_request
 def loger():
@@ -317,29 +412,13 @@ def loger():
         # Если пользователь анонимен, то необходимо
         # лог запись сохранять в куки
         if current_user.is_anonymous:
-            save_last_books(request.view_args.get('book_id'))
+            remember_in_session(request.view_args.get('book_id'))
         if current_user.is_authenticated:
             creating_last_book_log(request.view_args.get('book_id'),
                                    current_user.id)
-        book_visit_logs_params = {
-            'user_id': current_user.get_id(),
-            'book_id': request.view_args.get('book_id'),
-        }
-        start = datetime.now() - timedelta(days=1)
-        today_visits = (BookVisits.query
-                        .filter_by(book_id=request.view_args.get('book_id'))
-                        .filter(start <= BookVisits.created_at))
-        if current_user.is_authenticated:
-            today_visits = today_visits.filter_by(
-                user_id=current_user.get_id())
-        else:
-            today_visits = today_visits.filter(BookVisits.user_id.is_(None))
-        today_visits_int = len(today_visits.all())
-        # < 10, т.к. нумерация идет с 0
-        if today_visits_int < 10:
-            try:
-                db.session.add(BookVisits(**book_visit_logs_params))
-                db.session.commit()
-            except:
-                db.session.rollback()
+        # Не больше VISIT_CAP_LIMIT учтенных просмотров за сутки
+        if visit_cap.allow(current_user.get_id(),
+                           request.view_args.get('book_id')):
+            creating_book_visits(current_user.get_id(),
+                                 request.view_args.get('book_id'))
     
@@ -1,6 +1,11 @@
+import time
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import User
+import sqlalchemy as sa
+from sqlalchemy.orm import joinedload
+from app import app, db
+from models import User, Role
+from tool import LocalKVClient, TTLCache, SharedTTLCache
 from functools import wraps
 
 
@@ -15,10 +20,126 @@ def init_login_manager(app):
     login_manager.user_loader(load_user)
     login_manager.init_app(app)
 
+# Общий для воркеров кеш пользователей. Сброс всего кеша делается
+# сменой поколения ключей
+class SharedUserCache(SharedTTLCache):
+    def __init__(self, client):
+        super().__init__(client, 'user_cache')
+
+    def _generation(self):
+        generation = self.client.get('user_cache:generation') or b'0'
+        if isinstance(generation, bytes):
+            generation = generation.decode()
+        return generation
+
+    def _key(self, key):
+        return 'user_cache:%s:%s' % (self._generation(), key)
+
+    def clear(self):
+        self.client.set('user_cache:generation', str(time.time_ns()),
+                        ex=365 * 24 * 60 * 60)
+
+
+def _columns(obj, exclude=()):
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns
+            if c.key not in exclude}
+
+
+# Кеш пользователей для load_user. Хранится снимок полей пользователя
+# и его роли, объект User собирается из него заново на каждый запрос
+class UserCache:
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        snapshot = self.backend.get(user_id)
+        if snapshot is not None:
+            user = User(**snapshot['user'])
+            if snapshot['role'] is not None:
+                user.role = Role(**snapshot['role'])
+            return user
+        # Пользователь и роль одним запросом
+        user = (User.query.options(joinedload(User.role))
+                .filter(User.id == user_id).first())
+        if user is not None:
+            # Хеш пароля в кеш не попадает: для current_user он не нужен,
+            # а общий кеш лежит во внешнем сервере
+            self.backend.set(user_id, {
+                'user': _columns(user, exclude=('password_hash',)),
+                'role': _columns(user.role) if user.role else None,
+            }, self.ttl)
+        return user
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(int(user_id))
+
+
+def create_user_cache(app):
+    if app.config.get('USER_CACHE_BACKEND', 'memory') == 'shared':
+        backend = SharedUserCache(
+            app.config.get('USER_CACHE_CLIENT') or LocalKVClient())
+    else:
+        backend = TTLCache(app.config.get('USER_CACHE_SIZE', 1024))
+    return UserCache(backend, app.config.get('USER_CACHE_TTL', 300))
+
+
+user_cache = create_user_cache(app)
+
+
+# Сброс кеша при смене роли, пароля или других данных пользователя
+def invalidate_user(user_id=None):
+    user_cache.invalidate(user_id)
+
+
+# Изменения запоминаются в сессии и сбрасываются из кеша только после
+# commit: при сбросе во время flush параллельный запрос успел бы
+# положить в кеш старую строку на весь ttl. None - сбросить всех
+def _remember_change(target, user_id):
+    session = sa.orm.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(user_id)
+
+
+@sa.event.listens_for(User, 'after_update')
+@sa.event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    _remember_change(target, target.id)
+
+
+@sa.event.listens_for(Role, 'after_update')
+@sa.event.listens_for(Role, 'after_delete')
+def _role_changed(mapper, connection, target):
+    _remember_change(target, None)
+
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _invalidate_changed(session):
+    changed = session.info.pop('changed_users', None)
+    if not changed:
+        return
+    if None in changed:
+        invalidate_user()
+        return
+    for user_id in changed:
+        invalidate_user(user_id)
+
+
+@sa.event.listens_for(db.session, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop('changed_users', None)
+
+
 # Подгрузка объекта пользователя для LoginManager
 def load_user(user_id):
-    user = User.query.get(user_id)
-    return user
+    return user_cache.get(user_id)
 
 # Функция аутентификации
 @bp.route("/login", methods=["GET", "POST"])
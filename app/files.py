@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+# Права обычного файла с учетом umask процесса. Umask читается один раз
+# при импорте: os.umask меняет его для всего процесса
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+# Временный файл в том же каталоге, что и итоговый, чтобы os.replace
+# был атомарным. Каждый писатель получает свой файл
+def temp_file(directory, prefix='.tmp-'):
+    return tempfile.mkstemp(dir=directory, prefix=prefix, suffix='.part')
+
+
+# Публикация готового файла: mkstemp создает файлы с правами 0600,
+# и фронтовой прокси (X-Accel-Redirect), работающий под другим
+# пользователем, получал бы 403, поэтому права выставляются заранее
+def publish_file(tmp_path, path):
+    os.chmod(tmp_path, FILE_MODE)
+    os.replace(tmp_path, path)
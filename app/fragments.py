@@ -0,0 +1,119 @@
+import time
+from markupsafe import Markup
+from flask_login import current_user
+from app import app
+from tool import LocalKVClient, TTLCache, SharedTTLCache
+
+
+# Фрагменты страниц в памяти процесса (LRU с ttl).
+# Версии хранятся отдельно и не вытесняются. Фрагменты живут не
+# дольше процесса, поэтому версия, которую процесс еще не менял,
+# равна нулю: иначе новый воркер считал бы каталог только что
+# измененным и первые REPLICA_STICKY_SECONDS читал бы его с основной базы
+class LocalFragmentBackend(TTLCache):
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self._versions = {}
+
+    def version(self, name):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] = time.time_ns()
+
+
+# Общий для воркеров кеш во внешнем key-value сервере. Версия - метка
+# времени последнего изменения, поэтому потерянный ключ версии
+# заменяется новой меткой, а не нулем, и старые фрагменты не оживают
+class SharedFragmentBackend(SharedTTLCache):
+    version_ttl = 30 * 24 * 60 * 60
+
+    def __init__(self, client):
+        super().__init__(client, 'fragment_html')
+
+    def version(self, name):
+        value = self.client.get('fragment_version:' + name)
+        if value is None:
+            value = str(time.time_ns())
+            self.client.set('fragment_version:' + name, value,
+                            ex=self.version_ttl)
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def bump(self, name):
+        self.client.set('fragment_version:' + name, str(time.time_ns()),
+                        ex=self.version_ttl)
+
+
+# Кеш готового HTML частей страниц. Ключ фрагмента включает версии
+# данных, из которых он собран: изменение данных меняет версию,
+# и старые фрагменты просто перестают запрашиваться
+class FragmentCache:
+    def __init__(self, backend, ttl, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def key(self, name, versions, parts):
+        return ':'.join([name]
+                        + ['%s=%s' % (version, self.backend.version(version))
+                           for version in versions]
+                        + [str(part) for part in parts])
+
+    def render(self, name, render, versions=(), parts=(), ttl=None):
+        if not self.enabled:
+            return Markup(render())
+        key = self.key(name, versions, parts)
+        html = self.backend.get(key)
+        if html is None:
+            html = str(render())
+            self.backend.set(key, html, ttl or self.ttl)
+        return Markup(html)
+
+    def bump(self, *names):
+        for name in names:
+            self.backend.bump(name)
+
+    # Версия - метка времени изменения в наносекундах
+    def changed_within(self, name, seconds):
+        return (time.time_ns() - int(self.backend.version(name))
+                < seconds * 10 ** 9)
+
+
+def book_version(book_id):
+    return 'book:%s' % book_id
+
+
+# Кнопки действий во фрагментах зависят только от роли пользователя,
+# поэтому фрагменты хранятся по одному на роль, а не на пользователя
+def permission_bucket():
+    if current_user.is_authenticated:
+        return 'role%s' % current_user.role_id
+    return 'anon'
+
+
+# Сброс фрагментов после изменения книги или каталога
+def bump_catalog(book_id=None):
+    names = ['catalog']
+    if book_id is not None:
+        names.append(book_version(book_id))
+    fragment_cache.bump(*names)
+
+
+def create_fragment_cache(app):
+    if app.config.get('FRAGMENT_CACHE_BACKEND', 'memory') == 'shared':
+        backend = SharedFragmentBackend(
+            app.config.get('FRAGMENT_CACHE_CLIENT') or LocalKVClient())
+    else:
+        backend = LocalFragmentBackend(
+            app.config.get('FRAGMENT_CACHE_SIZE', 512))
+    # В памяти процесса изменения из других воркеров видны
+    # не позже чем через ttl секунд
+    return FragmentCache(backend, app.config.get('FRAGMENT_CACHE_TTL', 300),
+                         app.config.get('FRAGMENT_CACHE_ENABLED', True))
+
+
+fragment_cache = create_fragment_cache(app)
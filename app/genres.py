@@ -0,0 +1,68 @@
+import threading
+import time
+import sqlalchemy as sa
+from app import db, app
+from models import Genre
+
+
+# Справочник жанров на весь процесс. Жанры почти не меняются, поэтому
+# загружаются один раз и сбрасываются при любом изменении таблицы
+# (или по истечении ttl, чтобы подхватить изменения из других воркеров)
+class GenreRegistry:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._genres = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        genres = Genre.query.order_by(Genre.id).all()
+        # Отвязываем от сессии запроса, чтобы объекты жили между запросами
+        for genre in genres:
+            db.session.expunge(genre)
+        return {genre.id: genre for genre in genres}
+
+    def _cached(self):
+        genres = self._genres
+        if genres is None or self._expires_at <= time.monotonic():
+            genres = self._load()
+            with self._lock:
+                self._genres = genres
+                self._expires_at = time.monotonic() + self.ttl
+        return genres
+
+    def all(self):
+        return list(self._cached().values())
+
+    # Жанры по списку id из формы. Известные берутся из кеша без
+    # запросов к базе, неизвестные - одним запросом IN (...)
+    def resolve(self, ids):
+        ids = [int(genre_id) for genre_id in ids if str(genre_id).isdigit()]
+        cached = self._cached()
+        missing = [genre_id for genre_id in ids if genre_id not in cached]
+        found = {}
+        if missing:
+            found = {genre.id: genre for genre in
+                     Genre.query.filter(Genre.id.in_(missing))}
+            self.invalidate()
+        result = []
+        for genre_id in ids:
+            if genre_id in cached:
+                result.append(db.session.merge(cached[genre_id], load=False))
+            elif genre_id in found:
+                result.append(found[genre_id])
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._genres = None
+
+
+genre_registry = GenreRegistry(app.config.get('GENRE_CACHE_TTL', 600))
+
+
+@sa.event.listens_for(Genre, 'after_insert')
+@sa.event.listens_for(Genre, 'after_update')
+@sa.event.listens_for(Genre, 'after_delete')
+def _genre_changed(mapper, connection, target):
+    genre_registry.invalidate()
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+import click
+import sqlalchemy as sa
+from flask import session
+from flask_login import current_user, user_logged_in
+from app import db, app
+from models import LastBookVisits
+from tool import upsert
+
+
+def history_size():
+    return app.config.get('LAST_BOOKS_HISTORY_SIZE', 20)
+
+
+# Отметка о просмотре книги одним запросом: новая строка или
+# обновление времени у существующей пары (user_id, book_id).
+# Старые записи сверх history_size() удаляются в той же транзакции
+def record_last_visit(user_id, book_id, commit=True, created_at=None):
+    upsert(LastBookVisits,
+           [{'user_id': user_id, 'book_id': book_id,
+             'created_at': created_at or datetime.now()}],
+           ['user_id', 'book_id'],
+           lambda inserted: {'created_at': inserted.created_at})
+    trim_history(user_id)
+    if commit:
+        db.session.commit()
+
+
+# Удаление записей пользователя начиная с size-й по свежести.
+# При обычном просмотре лишней бывает одна запись, поиск идет
+# по индексу (user_id, created_at)
+def trim_history(user_id, size=None):
+    size = size or history_size()
+    ids = [row[0] for row in db.session.execute(
+        sa.select(LastBookVisits.id)
+        .where(LastBookVisits.user_id == user_id)
+        .order_by(LastBookVisits.created_at.desc(), LastBookVisits.id.desc())
+        .offset(size))]
+    if not ids:
+        return 0
+    return db.session.execute(
+        sa.delete(LastBookVisits).where(LastBookVisits.id.in_(ids))
+    ).rowcount
+
+
+def last_book_ids(user_id, limit):
+    return [row[0] for row in db.session.execute(
+        sa.select(LastBookVisits.book_id)
+        .where(LastBookVisits.user_id == user_id)
+        .order_by(LastBookVisits.created_at.desc(), LastBookVisits.id.desc())
+        .limit(limit))]
+
+
+SESSION_KEY = 'last_books'
+
+
+def session_size():
+    return app.config.get('LAST_BOOKS_SESSION_SIZE', 5)
+
+
+# История анонимного пользователя хранится в подписанной cookie сессии
+# строкой вида "1f.a.3" (id книг в 36-ричной записи, свежие первыми),
+# поэтому ее размер ограничен session_size() id
+def decode_book_ids(value):
+    if isinstance(value, list):
+        # Сессии, сохраненные до перехода на строку
+        items = [str(item) for item in value]
+        base = 10
+    else:
+        items = (value or '').split('.')
+        base = 36
+    ids = []
+    for item in items:
+        try:
+            book_id = int(item, base)
+        except ValueError:
+            continue
+        if book_id not in ids:
+            ids.append(book_id)
+    return ids
+
+
+def encode_book_ids(ids):
+    return '.'.join(to_base36(book_id) for book_id in ids)
+
+
+def to_base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        number, rest = divmod(number, 36)
+        result = digits[rest] + result
+        if not number:
+            return result
+
+
+def session_book_ids():
+    return decode_book_ids(session.get(SESSION_KEY))
+
+
+def remember_in_session(book_id):
+    ids = [book_id] + [item for item in session_book_ids() if item != book_id]
+    value = encode_book_ids(ids[:session_size()])
+    # Сессия не переписывается, если порядок не изменился
+    if session.get(SESSION_KEY) != value:
+        session[SESSION_KEY] = value
+
+
+# Недавно просмотренные книги текущего пользователя, свежие первыми
+def recent_book_ids(limit):
+    if current_user.is_authenticated:
+        return last_book_ids(current_user.id, limit)
+    return session_book_ids()[:limit]
+
+
+# При входе история из сессии переносится в LastBookVisits,
+# сохраняя порядок просмотров, и удаляется из cookie
+@user_logged_in.connect_via(app)
+def _hand_over_session_history(sender, user):
+    ids = session_book_ids()
+    session.pop(SESSION_KEY, None)
+    if not ids:
+        return
+    now = datetime.now()
+    try:
+        for position, book_id in reversed(list(enumerate(ids))):
+            record_last_visit(user.id, book_id, commit=False,
+                              created_at=now - timedelta(seconds=position))
+        db.session.commit()
+    except:
+        db.session.rollback()
+        app.logger.exception('Не удалось перенести историю просмотров')
+
+
+@app.cli.command('compact-last-visits')
+def compact_last_visits():
+    """Обрезать историю просмотров пользователей до LAST_BOOKS_HISTORY_SIZE."""
+    size = history_size()
+    users = [row[0] for row in db.session.execute(
+        sa.select(LastBookVisits.user_id)
+        .group_by(LastBookVisits.user_id)
+        .having(db.func.count(LastBookVisits.id) > size))]
+    removed = 0
+    for user_id in users:
+        removed += trim_history(user_id, size)
+        db.session.commit()
+    click.echo('Удалено записей истории: %d' % removed)
@@ -0,0 +1,41 @@
+from flask import g
+from sqlalchemy.orm import joinedload, selectinload
+from models import Book
+
+
+# Пакетная загрузка книг в пределах одного запроса.
+# Недостающие книги подгружаются одним запросом IN (...) вместе
+# с обложкой и жанрами, уже загруженные берутся из кеша запроса
+class BookLoader:
+    def __init__(self):
+        self._books = {}
+
+    def load_many(self, ids):
+        ids = [int(book_id) for book_id in ids if book_id is not None]
+        missing = {book_id for book_id in ids if book_id not in self._books}
+        if missing:
+            books = (Book.query
+                     .options(joinedload(Book.image),
+                              selectinload(Book.genres))
+                     .filter(Book.id.in_(missing),
+                             Book.purging.is_(False))
+                     .all())
+            for book in books:
+                self._books[book.id] = book
+            # Удаленные и удаляемые книги запоминаем, чтобы не запрашивать
+            # их повторно
+            for book_id in missing:
+                self._books.setdefault(book_id, None)
+        # Порядок совпадает с порядком ids, удаленные книги пропускаются
+        return [self._books[book_id] for book_id in ids
+                if self._books[book_id] is not None]
+
+    def load(self, book_id):
+        books = self.load_many([book_id])
+        return books[0] if books else None
+
+
+def book_loader():
+    if 'book_loader' not in g:
+        g.book_loader = BookLoader()
+    return g.book_loader
@@ -1,8 +1,19 @@
-from flask import Blueprint, render_template, request
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+from flask import (Blueprint, render_template, request, jsonify, abort,
+                   Response, stream_with_context, redirect, url_for, flash)
+import sqlalchemy as sa
 from flask_login import login_required
 from app import db, app
-from models import BookVisits, Book
+from sqlalchemy.orm import joinedload
+from models import Book, User, BookVisits, BookVisitTotals, DailyBookVisits
 from auth import check_rights
+from visits import visit_writer
+from pagination import KeysetPagination
+from sql_timing import query_stats, sql_timing_enabled
+from routing import read_replica
 
 bp = Blueprint('logs', __name__, url_prefix='/logs')
 
@@ -11,10 +22,15 @@ bp = Blueprint('logs', __name__, url_prefix='/logs')
 @bp.route('/users_statistics')
 @login_required
 @check_rights('get_logs')
+@read_replica
 def users_statistics():
     page = request.args.get('page', 1, type=int)
-    logs = BookVisits.query.order_by(BookVisits.created_at.desc())
-    pagination = logs.paginate(page=page, per_page=app.config['LOGS_PER_PAGE'])
+    pagination = KeysetPagination(
+        BookVisits.query, [BookVisits.created_at, BookVisits.id],
+        app.config['LOGS_PER_PAGE'],
+        page=page, cursor=request.args.get('cursor'),
+        offset_pages=app.config.get('KEYSET_OFFSET_PAGES', 5),
+        count_key='book_visits')
     logs = pagination.items
     return render_template('logs/users_statistics.html',
                            logs=logs,
@@ -25,17 +41,172 @@ def users_statistics():
 @bp.route('/books_statistics')
 @login_required
 @check_rights('get_logs')
+@read_replica
 def books_statistics():
     page = request.args.get('page', 1, type=int)
-    books_stat_data = db.session.query(BookVisits.book_id, db.func.count(BookVisits.id)).group_by(BookVisits.book_id).order_by(db.func.count(BookVisits.id).desc())
-    pagination = books_stat_data.paginate(page=page, per_page=app.config['LOGS_PER_PAGE'])
-    books_stat_data = pagination.items
-    data_for_render = []
-    for book_id, count in  books_stat_data:
-        data_for_render.append((Book.query.get(book_id), count))
-
-    print(data_for_render)
-    
+    # Упорядоченный проход по индексу итогов вместо GROUP BY по журналу
+    totals = (BookVisitTotals.query
+              .options(joinedload(BookVisitTotals.book)))
+    pagination = KeysetPagination(
+        totals, [BookVisitTotals.visits, BookVisitTotals.book_id],
+        app.config['LOGS_PER_PAGE'],
+        page=page, cursor=request.args.get('cursor'),
+        offset_pages=app.config.get('KEYSET_OFFSET_PAGES', 5),
+        count_key='book_visit_totals')
+
     return render_template('logs/books_statistics.html',
-                           logs=data_for_render,
-                           pagination=pagination)
\ No newline at end of file
+                           logs=pagination.items,
+                           pagination=pagination)
+
+
+# Состояние записи посещений: глубина очереди и время сброса
+@bp.route('/visits_queue')
+@login_required
+@check_rights('get_logs')
+def visits_queue():
+    return jsonify(visit_writer.stats())
+
+
+# Самые затратные запросы к базе по суммарному времени
+# (собираются при SQL_TIMING_ENABLED)
+@bp.route('/queries')
+@login_required
+@check_rights('get_logs')
+def queries():
+    limit = request.args.get('limit', 50, type=int)
+    return render_template('logs/queries.html',
+                           enabled=sql_timing_enabled,
+                           queries=query_stats.top(limit))
+
+
+@bp.route('/queries/reset', methods=['POST'])
+@login_required
+@check_rights('get_logs')
+def reset_queries():
+    query_stats.reset()
+    flash('Статистика запросов сброшена', 'success')
+    return redirect(url_for('logs.queries'))
+
+
+# Выгрузка журнала и статистики потоком (CSV или NDJSON).
+# Строки читаются порциями по EXPORT_CHUNK_SIZE отдельными запросами
+# по ключу (WHERE key > последний ORDER BY key LIMIT), поэтому память
+# не зависит от объема выгрузки. Курсор на стороне сервера не подходит:
+# mysql-connector читает весь результат в память до первой строки
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_date_range():
+    date_from = request.args.get('date_from', type=date.fromisoformat)
+    date_to = request.args.get('date_to', type=date.fromisoformat)
+    return date_from, date_to
+
+
+def export_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+# Ключ - первый столбец выборки, уникальный в результате
+def read_batches(stmt, key, chunk_size):
+    last = None
+    while True:
+        batch = stmt if last is None else stmt.where(key > last)
+        rows = db.session.execute(
+            batch.order_by(key).limit(chunk_size)).all()
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def stream_rows(stmt, key, columns, fmt):
+    chunk_size = app.config.get('EXPORT_CHUNK_SIZE', 1000)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(columns)
+    for rows in read_batches(stmt, key, chunk_size):
+        for row in rows:
+            values = [export_value(value) for value in row]
+            if fmt == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(columns, values)),
+                                        ensure_ascii=False))
+                buffer.write('\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(stmt, key, columns, fmt, name):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    return Response(
+        stream_with_context(stream_rows(stmt, key, columns, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition':
+                 'attachment; filename=%s.%s' % (name, fmt)})
+
+
+@bp.route('/export/visits.<fmt>')
+@login_required
+@check_rights('get_logs')
+@read_replica
+def export_visits(fmt):
+    date_from, date_to = export_date_range()
+    stmt = (sa.select(BookVisits.id, BookVisits.created_at,
+                      BookVisits.user_id, User.login,
+                      BookVisits.book_id, Book.name)
+            .outerjoin(User, User.id == BookVisits.user_id)
+            .outerjoin(Book, Book.id == BookVisits.book_id))
+    if date_from:
+        stmt = stmt.where(BookVisits.created_at
+                          >= datetime.combine(date_from, time.min))
+    if date_to:
+        stmt = stmt.where(BookVisits.created_at
+                          < datetime.combine(date_to + timedelta(days=1),
+                                             time.min))
+    columns = ['id', 'created_at', 'user_id', 'user_login',
+               'book_id', 'book_name']
+    return export_response(stmt, BookVisits.id, columns, fmt, 'visits')
+
+
+@bp.route('/export/books.<fmt>')
+@login_required
+@check_rights('get_logs')
+@read_replica
+def export_books(fmt):
+    date_from, date_to = export_date_range()
+    # Книги идут по возрастанию id: порядок по числу просмотров
+    # не позволил бы читать выгрузку порциями по ключу
+    if date_from or date_to:
+        # За период - по посуточной сводке
+        key = DailyBookVisits.book_id
+        visits = db.func.sum(DailyBookVisits.visits)
+        stmt = (sa.select(DailyBookVisits.book_id, Book.name, visits)
+                .join(Book, Book.id == DailyBookVisits.book_id)
+                .group_by(DailyBookVisits.book_id, Book.name))
+        if date_from:
+            stmt = stmt.where(DailyBookVisits.day >= date_from)
+        if date_to:
+            stmt = stmt.where(DailyBookVisits.day <= date_to)
+        columns = ['book_id', 'book_name', 'visits']
+    else:
+        key = BookVisitTotals.book_id
+        stmt = (sa.select(BookVisitTotals.book_id, Book.name,
+                          BookVisitTotals.visits,
+                          BookVisitTotals.auth_visits,
+                          BookVisitTotals.anon_visits)
+                .join(Book, Book.id == BookVisitTotals.book_id))
+        columns = ['book_id', 'book_name', 'visits', 'auth_visits',
+                   'anon_visits']
+    return export_response(stmt, key, columns, fmt, 'books')
@@ -0,0 +1,34 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import markdown
+
+
+# LRU-кеш отрисованного markdown, ключ - хеш исходного текста.
+# Нужен только для строк, у которых еще нет сохраненного HTML
+class MarkdownCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, text):
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            html = self._data.get(key)
+            if html is not None:
+                self._data.move_to_end(key)
+                return html
+        html = markdown.markdown(text)
+        with self._lock:
+            self._data[key] = html
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return html
+
+
+markdown_cache = MarkdownCache()
+
+
+def render_markdown(text):
+    return markdown_cache.render(text or '')
@@ -0,0 +1,95 @@
+"""add composite indexes
+
+Revision ID: 0b5d3f8e2c71
+Revises: 75e8c995e57c
+Create Date: 2026-10-18 16:05:37.402915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b5d3f8e2c71'
+down_revision = '75e8c995e57c'
+branch_labels = None
+depends_on = None
+
+# Индексы внешних ключей, которые MySQL удаляет сам, когда появляется
+# составной индекс с тем же первым столбцом
+FK_INDEXES = [
+    ('book_visits', 'book_id', 'fk_book_visits_book_id_books'),
+    ('last_book_visits', 'user_id', 'fk_last_book_visits_user_id_users'),
+    ('reviews', 'book_id', 'fk_reviews_book_id_books'),
+    ('books', 'image_id', 'fk_books_image_id_images'),
+]
+
+
+def _delete_duplicates(table, columns, keep):
+    # Вложенная выборка через производную таблицу, иначе MySQL
+    # не разрешает удалять из таблицы, по которой идет подзапрос
+    columns = ', '.join(columns)
+    op.execute(sa.text(
+        'DELETE FROM {table} WHERE id NOT IN ('
+        'SELECT id FROM (SELECT {keep}(id) AS id FROM {table} '
+        'GROUP BY {columns}) AS keep_rows)'
+        .format(table=table, keep=keep, columns=columns)))
+
+
+def upgrade():
+    # Из повторов последних посещений остается самая свежая запись,
+    # из повторов рецензий - первая
+    _delete_duplicates('last_book_visits', ['user_id', 'book_id'], 'MAX')
+    _delete_duplicates('reviews', ['book_id', 'user_id'], 'MIN')
+    # Рейтинг книг пересчитывается по оставшимся рецензиям
+    op.execute(sa.text(
+        'UPDATE books SET '
+        'rating_sum = (SELECT COALESCE(SUM(reviews.rating), 0) FROM reviews '
+        'WHERE reviews.book_id = books.id), '
+        'rating_num = (SELECT COUNT(reviews.id) FROM reviews '
+        'WHERE reviews.book_id = books.id)'))
+
+    with op.batch_alter_table('book_visits', schema=None) as batch_op:
+        batch_op.create_index('ix_book_visits_book_id_user_id_created_at',
+                              ['book_id', 'user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_book_visits_created_at_id',
+                              ['created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('last_book_visits', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_last_book_visits_user_id_book_id',
+                                          ['user_id', 'book_id'])
+        batch_op.create_index('ix_last_book_visits_user_id_created_at',
+                              ['user_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_reviews_book_id_user_id',
+                                          ['book_id', 'user_id'])
+
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_books_image_id'), ['image_id'],
+                              unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        inspector = sa.inspect(bind)
+        for table, column, name in FK_INDEXES:
+            if name not in {index['name']
+                            for index in inspector.get_indexes(table)}:
+                op.create_index(name, table, [column], unique=False)
+
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_books_image_id'))
+
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_reviews_book_id_user_id', type_='unique')
+
+    with op.batch_alter_table('last_book_visits', schema=None) as batch_op:
+        batch_op.drop_index('ix_last_book_visits_user_id_created_at')
+        batch_op.drop_constraint('uq_last_book_visits_user_id_book_id',
+                                 type_='unique')
+
+    with op.batch_alter_table('book_visits', schema=None) as batch_op:
+        batch_op.drop_index('ix_book_visits_created_at_id')
+        batch_op.drop_index('ix_book_visits_book_id_user_id_created_at')
@@ -0,0 +1,32 @@
+"""add books fulltext index
+
+Revision ID: 75e8c995e57c
+Revises: 6991f11af57f
+Create Date: 2026-10-18 15:40:52.118306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '75e8c995e57c'
+down_revision = '6991f11af57f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Полнотекстовый индекс есть только в MySQL, на других СУБД
+    # поиск работает по индексу в памяти приложения
+    if op.get_bind().dialect.name != 'mysql':
+        return
+    op.create_index('ix_books_fulltext', 'books',
+                    ['name', 'author', 'publisher', 'short_desc'],
+                    unique=False, mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'mysql':
+        return
+    op.drop_index('ix_books_fulltext', table_name='books')
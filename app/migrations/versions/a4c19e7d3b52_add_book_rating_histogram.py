@@ -0,0 +1,37 @@
+"""add book rating histogram
+
+Revision ID: a4c19e7d3b52
+Revises: 0b5d3f8e2c71
+Create Date: 2026-10-18 16:48:12.550374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c19e7d3b52'
+down_revision = '0b5d3f8e2c71'
+branch_labels = None
+depends_on = None
+
+RATING_VALUES = range(0, 6)
+
+
+def upgrade():
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        for value in RATING_VALUES:
+            batch_op.add_column(sa.Column('rating_%d' % value, sa.Integer(),
+                                          nullable=False, server_default='0'))
+
+    # Заполнение гистограммы по уже опубликованным рецензиям
+    op.execute(sa.text('UPDATE books SET ' + ', '.join(
+        'rating_{0} = (SELECT COUNT(reviews.id) FROM reviews '
+        'WHERE reviews.book_id = books.id AND reviews.rating = {0})'
+        .format(value) for value in RATING_VALUES)))
+
+
+def downgrade():
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        for value in reversed(RATING_VALUES):
+            batch_op.drop_column('rating_%d' % value)
@@ -0,0 +1,31 @@
+"""allow anonymous book visits
+
+Revision ID: c7e2a91f4d60
+Revises: a4c19e7d3b52
+Create Date: 2026-10-18 18:02:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a91f4d60'
+down_revision = 'a4c19e7d3b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Просмотры анонимных пользователей пишутся с пустым user_id
+    with op.batch_alter_table('book_visits', schema=None) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(),
+                              nullable=True)
+
+
+def downgrade():
+    # Анонимные просмотры в прежней схеме не помещаются
+    op.execute(sa.text('DELETE FROM book_visits WHERE user_id IS NULL'))
+    with op.batch_alter_table('book_visits', schema=None) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(),
+                              nullable=False)
@@ -0,0 +1,29 @@
+"""add book purging flag
+
+Revision ID: e1f6b8a3c925
+Revises: c7e2a91f4d60
+Create Date: 2026-10-18 19:12:07.430518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f6b8a3c925'
+down_revision = 'c7e2a91f4d60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Отметка фонового удаления видна всем процессам и переживает перезапуск
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('purging', sa.Boolean(),
+                                      nullable=False,
+                                      server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        batch_op.drop_column('purging')
@@ -4,10 +4,12 @@ from flask import url_for, current_app
 from flask_login import UserMixin
 from werkzeug.security import check_password_hash, generate_password_hash
 from sqlalchemy.dialects.mysql import YEAR
-import markdown
 import bleach
 from app import db
-from users_policy import UsersPolicy
+from users_policy import permission_matrix
+from markup import render_markdown
+
+RATING_VALUES = range(0, 6)
 
 books_genres = db.Table(
     "books_genres",
@@ -23,23 +25,38 @@ class Book(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(256), nullable=False)
     short_desc = db.Column(db.Text, nullable=False)
+    short_desc_html = db.Column(db.Text)
     year_release = db.Column(YEAR, nullable=False)
     publisher = db.Column(db.String(256), nullable=False)
     author = db.Column(db.String(256), nullable=False)
     pages_volume = db.Column(db.Integer, nullable=False)
     image_id = db.Column(db.String(256), db.ForeignKey(
-        "images.id"), nullable=False)
+        "images.id"), nullable=False, index=True)
     rating_sum = db.Column(db.Integer, nullable=False, default=0)
     rating_num = db.Column(db.Integer, nullable=False, default=0)
+    # Количество оценок 0..5
+    rating_0 = db.Column(db.Integer, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    # Книга удаляется в фоне и уже не показывается
+    purging = db.Column(db.Boolean, nullable=False, default=False,
+                        server_default=sa.false())
     genres = db.relationship(
         "Genre", secondary=books_genres, backref="bookss")
     image = db.relationship("Image")
 
     def prepare_to_save(self):
         self.short_desc = bleach.clean(self.short_desc)
+        self.short_desc_html = render_markdown(self.short_desc)
 
-    def prepare_to_html(self):
-        self.short_desc = markdown.markdown(self.short_desc)
+    # HTML описания для шаблонов. Для строк без сохраненного HTML
+    # он берется из кеша отрисовки
+    @property
+    def html_short_desc(self):
+        return self.short_desc_html or render_markdown(self.short_desc)
 
     @property
     def rating(self):
@@ -47,6 +64,12 @@ class Book(db.Model):
             return self.rating_sum / self.rating_num
         return 0
 
+    # Пары (оценка, количество) от лучшей к худшей
+    @property
+    def rating_histogram(self):
+        return [(value, getattr(self, "rating_%d" % value))
+                for value in reversed(RATING_VALUES)]
+
     def __repr__(self):
         return "<Book %r>" % self.name
 
@@ -73,7 +96,12 @@ class Image(db.Model):
 
     @property
     def url(self):
-        return url_for("image", image_id=self.id)
+        return url_for("image", image_id=self.id, md5_hash=self.md5_hash)
+
+    @property
+    def thumb_url(self):
+        return url_for("image", image_id=self.id, md5_hash=self.md5_hash,
+                       size="thumb")
 
     def __repr__(self):
         return "<Image %r>" % self.file_name
@@ -88,17 +116,25 @@ class Review(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
     rating = db.Column(db.Integer, nullable=False)
     text = db.Column(db.Text, nullable=False)
+    text_html = db.Column(db.Text)
     created_at = db.Column(db.DateTime, nullable=False,
                            server_default=sa.sql.func.now())
 
     user = db.relationship("User")
     book = db.relationship("Book")
 
+    __table_args__ = (
+        db.UniqueConstraint("book_id", "user_id",
+                            name="uq_reviews_book_id_user_id"),
+    )
+
     def prepare_to_save(self):
         self.text = bleach.clean(self.text)
+        self.text_html = render_markdown(self.text)
 
-    def prepare_to_html(self):
-        self.text = markdown.markdown(self.text)
+    @property
+    def html_text(self):
+        return self.text_html or render_markdown(self.text)
 
     def __repr__(self):
         return "<Review %r>" % self.user_id
@@ -139,11 +175,14 @@ class User(db.Model, UserMixin):
         return self.role_id == current_app.config['USER_ROLE_ID']
 
     def can(self, action, record=None):
-        users_policy = UsersPolicy(record)
-        method = getattr(users_policy, action, None)
-        if method:
-            return method()
-        return False
+        if record is not None:
+            return permission_matrix.allowed(self, action, record)
+        # Flask-Login загружает пользователя заново на каждый запрос,
+        # поэтому ответы запоминаются на время запроса
+        answers = self.__dict__.setdefault('_permissions', {})
+        if action not in answers:
+            answers[action] = permission_matrix.allowed(self, action)
+        return answers[action]
     
     def __repr__(self):
         return "<User %r>" % self.login
@@ -166,7 +205,7 @@ class BookVisits(db.Model):
     __tablename__ = "book_visits"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     book_id = db.Column(db.Integer, db.ForeignKey("books.id"), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False,
                            server_default=sa.sql.func.now())
@@ -174,6 +213,12 @@ class BookVisits(db.Model):
     book = db.relationship("Book")
     user = db.relationship("User")
 
+    __table_args__ = (
+        db.Index("ix_book_visits_book_id_user_id_created_at",
+                 "book_id", "user_id", "created_at"),
+        db.Index("ix_book_visits_created_at_id", "created_at", "id"),
+    )
+
     def __repr__(self):
         return "<VisitLog %r>" % self.id
     
@@ -190,5 +235,47 @@ class LastBookVisits(db.Model):
     book = db.relationship("Book")
     user = db.relationship("User")
 
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "book_id",
+                            name="uq_last_book_visits_user_id_book_id"),
+        db.Index("ix_last_book_visits_user_id_created_at",
+                 "user_id", "created_at"),
+    )
+
     def __repr__(self):
         return "<LastVisitLog %r>" % self.id
+
+
+class DailyBookVisits(db.Model):
+
+    __tablename__ = "book_visit_daily"
+
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id"),
+                        primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+
+    book = db.relationship("Book")
+
+    def __repr__(self):
+        return "<DailyVisits %r %r>" % (self.book_id, self.day)
+
+
+class BookVisitTotals(db.Model):
+
+    __tablename__ = "book_visit_totals"
+
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id"),
+                        primary_key=True, autoincrement=False)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+    auth_visits = db.Column(db.Integer, nullable=False, default=0)
+    anon_visits = db.Column(db.Integer, nullable=False, default=0)
+
+    book = db.relationship("Book")
+
+    __table_args__ = (
+        db.Index("ix_book_visit_totals_visits_book_id", "visits", "book_id"),
+    )
+
+    def __repr__(self):
+        return "<VisitTotals %r>" % self.book_id
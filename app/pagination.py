@@ -0,0 +1,133 @@
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+import sqlalchemy as sa
+
+
+# Курсор хранит направление и значения ключей сортировки
+# граничной записи страницы
+def encode_cursor(direction, values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps([direction, values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(raw)
+        if direction not in ('next', 'prev') or len(values) != len(columns):
+            return None
+        return direction, [
+            datetime.fromisoformat(v)
+            if column.type.python_type is datetime else column.type.python_type(v)
+            for column, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+# Приблизительное число строк: COUNT(*) выполняется не чаще раза в ttl секунд
+class ApproximateCounter:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def count(self, key, query):
+        item = self._data.get(key)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        total = query.order_by(None).count()
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, total)
+        return total
+
+
+approximate_counter = ApproximateCounter()
+
+
+# Постраничный вывод по ключу (keyset). Записи сортируются по убыванию
+# columns, следующая страница выбирается условием по значениям
+# ключей последней записи, поэтому не нужны ни OFFSET, ни COUNT(*).
+# Первые offset_pages страниц по-прежнему доступны по номеру,
+# более далекие номера сводятся к последней из них
+class KeysetPagination:
+    keyset = True
+
+    def __init__(self, query, columns, per_page, page=1, cursor=None,
+                 offset_pages=5, count_key=None):
+        self.columns = columns
+        self.per_page = per_page
+        self.offset_pages = offset_pages
+        self.page = None
+        self.prev_cursor = None
+        self.next_cursor = None
+        self.has_prev = False
+        self.has_next = False
+
+        decoded = decode_cursor(cursor, columns) if cursor else None
+        if decoded is None:
+            # Номера страниц дальше offset_pages не обслуживаются через
+            # OFFSET: отдается последняя нумерованная страница, а от нее
+            # дальше идет курсор
+            self._offset_page(query,
+                              min(max(page, 1), max(offset_pages, 1)))
+        else:
+            self._keyset_page(query, *decoded)
+
+        self.total = approximate_counter.count(count_key, query) \
+            if count_key else None
+
+    def _key(self, item):
+        return [getattr(item, column.key) for column in self.columns]
+
+    def _offset_page(self, query, page):
+        self.page = page
+        items = (query.order_by(*[c.desc() for c in self.columns])
+                 .offset((page - 1) * self.per_page)
+                 .limit(self.per_page + 1).all())
+        self.has_next = len(items) > self.per_page
+        self.items = items[:self.per_page]
+        self.has_prev = page > 1
+        if self.has_next and page >= self.offset_pages:
+            self.next_cursor = encode_cursor('next', self._key(self.items[-1]))
+
+    def _keyset_page(self, query, direction, values):
+        key = sa.tuple_(*self.columns)
+        bound = sa.tuple_(*[sa.literal(v, c.type)
+                             for c, v in zip(self.columns, values)])
+        if direction == 'next':
+            items = (query.filter(key < bound)
+                     .order_by(*[c.desc() for c in self.columns])
+                     .limit(self.per_page + 1).all())
+            self.has_next = len(items) > self.per_page
+            self.items = items[:self.per_page]
+            self.has_prev = True
+        else:
+            items = (query.filter(key > bound)
+                     .order_by(*[c.asc() for c in self.columns])
+                     .limit(self.per_page + 1).all())
+            self.has_prev = len(items) > self.per_page
+            self.items = list(reversed(items[:self.per_page]))
+            self.has_next = True
+        if self.items:
+            if self.has_prev:
+                self.prev_cursor = encode_cursor('prev',
+                                                 self._key(self.items[0]))
+            if self.has_next:
+                self.next_cursor = encode_cursor('next',
+                                                 self._key(self.items[-1]))
+
+    @property
+    def prev_args(self):
+        if self.prev_cursor:
+            return {'cursor': self.prev_cursor}
+        return {'page': self.page - 1} if self.page else {}
+
+    @property
+    def next_args(self):
+        if self.next_cursor:
+            return {'cursor': self.next_cursor}
+        return {'page': self.page + 1} if self.page else {}
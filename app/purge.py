@@ -0,0 +1,140 @@
+import os
+import threading
+import click
+import sqlalchemy as sa
+from app import db, app
+from models import (Book, Image, Review, BookVisits, LastBookVisits,
+                    DailyBookVisits, BookVisitTotals, books_genres)
+from tool import image_meta
+from thumbnails import thumbnails
+from search import search_index
+from fragments import bump_catalog
+
+# Таблицы, строки которых ссылаются на книгу
+BOOK_DEPENDENTS = [LastBookVisits, DailyBookVisits, BookVisitTotals, Review]
+
+def count_visits(book_id):
+    return (db.session.query(db.func.count(BookVisits.id))
+            .filter(BookVisits.book_id == book_id).scalar())
+
+
+# Сколько книг использует обложку (по индексу books.image_id)
+def count_image_references(image_id):
+    return (db.session.query(db.func.count(Book.id))
+            .filter(Book.image_id == image_id).scalar())
+
+
+# Удаление книги и всех зависимостей множественными DELETE.
+# Возвращает имя файла обложки, если обложка больше никому не нужна:
+# файл удаляется только после коммита
+def delete_book_rows(book_id):
+    book = db.session.get(Book, book_id)
+    if book is None:
+        return None
+    references = count_image_references(book.image_id)
+    db.session.execute(sa.delete(BookVisits)
+                       .where(BookVisits.book_id == book_id))
+    for model in BOOK_DEPENDENTS:
+        db.session.execute(sa.delete(model).where(model.book_id == book_id))
+    db.session.execute(sa.delete(books_genres)
+                       .where(books_genres.c.book_id == book_id))
+    db.session.execute(sa.delete(Book).where(Book.id == book_id))
+    file_name = None
+    # Если зависимость единственная, то обложку можно удалить
+    if references == 1:
+        image = db.session.get(Image, book.image_id)
+        file_name = image.file_name
+        db.session.execute(sa.delete(Image).where(Image.id == image.id))
+        image_meta.forget(image.id)
+    db.session.expunge(book)
+    return file_name
+
+
+def remove_cover_files(file_name):
+    if file_name is None:
+        return
+    path = os.path.join(app.config['UPLOAD_FOLDER'], file_name)
+    if os.path.exists(path):
+        os.remove(path)
+    thumbnails.remove(file_name)
+
+
+def delete_book(book_id):
+    try:
+        file_name = delete_book_rows(book_id)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    search_index.remove(book_id)
+    bump_catalog(book_id)
+    remove_cover_files(file_name)
+
+
+# Фоновое удаление книги с большим журналом просмотров:
+# журнал удаляется порциями по chunk_size строк, каждая в своей
+# короткой транзакции, затем книга со всеми зависимостями удаляется
+# одной транзакцией. При ошибке книга остается отмеченной (purging)
+# и удаление можно продолжить командой resume-purges
+def purge_book(flask_app, book_id, chunk_size):
+    with flask_app.app_context():
+        try:
+            while True:
+                ids = [row[0] for row in db.session.execute(
+                    sa.select(BookVisits.id)
+                    .where(BookVisits.book_id == book_id)
+                    .limit(chunk_size))]
+                if not ids:
+                    break
+                db.session.execute(sa.delete(BookVisits)
+                                   .where(BookVisits.id.in_(ids)))
+                db.session.commit()
+            delete_book(book_id)
+            flask_app.logger.info('Книга %s удалена', book_id)
+            return True
+        except:
+            db.session.rollback()
+            flask_app.logger.exception('Не удалось удалить книгу %s', book_id)
+            return False
+
+
+# Отметка книги в базе видна всем процессам: книга сразу пропадает
+# из каталога, со своей страницы, из популярных, истории и поиска.
+# Повторный запрос на удаление той же книги ничего не делает
+# и возвращает None
+def start_purge(book_id):
+    try:
+        marked = db.session.execute(
+            sa.update(Book)
+            .where(Book.id == book_id, Book.purging.is_(False))
+            .values(purging=True)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    if not marked:
+        return None
+    search_index.remove(book_id)
+    bump_catalog(book_id)
+    thread = threading.Thread(
+        target=purge_book,
+        args=(app, book_id, app.config.get('PURGE_CHUNK_SIZE', 5000)),
+        name='book-purge-%s' % book_id, daemon=True)
+    thread.start()
+    return thread
+
+
+# Удаления, прерванные перезапуском или ошибкой
+@app.cli.command('resume-purges')
+def resume_purges():
+    """Завершить незаконченные фоновые удаления книг."""
+    book_ids = [row[0] for row in db.session.execute(
+        sa.select(Book.id).where(Book.purging.is_(True)).order_by(Book.id))]
+    chunk_size = app.config.get('PURGE_CHUNK_SIZE', 5000)
+    failed = 0
+    for book_id in book_ids:
+        if not purge_book(app, book_id, chunk_size):
+            failed += 1
+    click.echo('Удалено книг: %d, с ошибкой: %d'
+               % (len(book_ids) - failed, failed))
@@ -0,0 +1,57 @@
+import click
+import sqlalchemy as sa
+from app import db, app
+from models import Book, Review, RATING_VALUES
+
+
+def rating_column(value):
+    return getattr(Book, 'rating_%d' % value)
+
+
+# Учет новой оценки одним UPDATE с выражениями на стороне базы:
+# параллельные рецензии не затирают друг друга, а строка книги
+# блокируется только на время самого UPDATE
+def add_rating(book_id, rating):
+    rating = int(rating)
+    if rating not in RATING_VALUES:
+        raise ValueError('rating must be in 0..5, got %r' % rating)
+    column = rating_column(rating)
+    result = db.session.execute(
+        sa.update(Book).where(Book.id == book_id)
+        .values({Book.rating_sum: Book.rating_sum + rating,
+                 Book.rating_num: Book.rating_num + 1,
+                 column: column + 1})
+        .execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        raise LookupError('book %s not found' % book_id)
+
+
+def _reviews_of_book(expression):
+    return (sa.select(expression).where(Review.book_id == Book.id)
+            .correlate(Book).scalar_subquery())
+
+
+# Пересчет суммы, количества и гистограммы оценок по таблице reviews
+def rebuild_ratings(book_id=None):
+    values = {
+        Book.rating_sum: _reviews_of_book(
+            db.func.coalesce(db.func.sum(Review.rating), 0)),
+        Book.rating_num: _reviews_of_book(db.func.count(Review.id)),
+    }
+    for value in RATING_VALUES:
+        values[rating_column(value)] = _reviews_of_book(
+            db.func.count(sa.case((Review.rating == value, Review.id))))
+    stmt = sa.update(Book).values(values)
+    if book_id is not None:
+        stmt = stmt.where(Book.id == book_id)
+    result = db.session.execute(
+        stmt.execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+
+@app.cli.command('reconcile-ratings')
+@click.option('--book-id', type=int, default=None)
+def reconcile_ratings(book_id):
+    """Пересчитать рейтинги книг по рецензиям."""
+    click.echo('Пересчитано книг: %d' % rebuild_ratings(book_id))
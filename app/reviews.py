@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import current_user, login_required
 from app import db
-from models import Review, Book
+from models import Review
 from auth import check_rights
+from ratings import add_rating
+from fragments import bump_catalog
 
 bp = Blueprint('reviews', __name__, url_prefix='/reviews')
 
@@ -25,13 +27,14 @@ def new(book_id):
             review.prepare_to_save()
 
             try:
-
-                book = Book.query.filter_by(id=book_id).first()   
-                book.rating_sum += int(params['rating'])
-                book.rating_num += 1
                 db.session.add(review)
-                db.session.add(book)
+                # Повторная рецензия отсекается уникальным ключом
+                # до изменения рейтинга книги
+                db.session.flush()
+                add_rating(book_id, params['rating'])
                 db.session.commit()
+                # Рейтинг виден и в каталоге, и на странице книги
+                bump_catalog(book_id)
                 flash('Рецензия успешно опубликована', 'success')
             except:
                 db.session.rollback()
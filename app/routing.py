@@ -0,0 +1,95 @@
+import functools
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context
+from flask import session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.expression import Select, TextClause
+from sqlalchemy.sql.dml import UpdateBase
+
+STICKY_KEY = '_primary_until'
+
+
+# Чтение с реплики включается только в отмеченных представлениях
+# (read_replica) и блоках (replica_reads)
+def replica_scope_active():
+    if not has_app_context():
+        return False
+    return g.get('_replica_view', False) or g.get('_replica_depth', 0) > 0
+
+
+def read_replica(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Флаг живет до конца запроса, в том числе пока
+        # отдается потоковый ответ
+        g._replica_view = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def replica_reads():
+    depth = g.get('_replica_depth', 0)
+    g._replica_depth = depth + 1
+    try:
+        yield
+    finally:
+        g._replica_depth = depth
+
+
+# Служебные записи (журнал просмотров, история последних книг) не
+# закрепляют пользователя за основной базой: иначе каждый просмотр
+# книги переписывал бы cookie и отключал чтение с реплики
+@contextmanager
+def no_sticky_writes():
+    depth = g.get('_no_sticky_depth', 0)
+    g._no_sticky_depth = depth + 1
+    try:
+        yield
+    finally:
+        g._no_sticky_depth = depth
+
+
+def is_write(session, clause):
+    if session._flushing or isinstance(clause, (UpdateBase, TextClause)):
+        return True
+    return isinstance(clause, Select) and clause._for_update_arg is not None
+
+
+# Сессия, которая отправляет чтение в отмеченных местах на реплику
+# (bind REPLICA_BIND_KEY), а все остальное - на основную базу.
+# После записи сессия до конца запроса читает с основной базы, а
+# пользователь - еще REPLICA_STICKY_SECONDS, чтобы видеть свои изменения
+# несмотря на отставание реплики
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if is_write(self, clause):
+                self._remember_write()
+            elif replica_scope_active() and not self._sticky():
+                replica = self._db.engines.get(
+                    current_app.config.get('REPLICA_BIND_KEY', 'replica'))
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+    def _sticky(self):
+        if self.info.get('wrote'):
+            return True
+        if has_request_context():
+            return flask_session.get(STICKY_KEY, 0) > time.time()
+        return False
+
+    def _remember_write(self):
+        self.info['wrote'] = True
+        if not has_request_context() or g.get('_no_sticky_depth', 0):
+            return
+        sticky = current_app.config.get('REPLICA_STICKY_SECONDS', 5)
+        if not sticky:
+            return
+        until = time.time() + sticky
+        # Cookie переписывается не на каждую запись
+        if flask_session.get(STICKY_KEY, 0) < until - sticky / 2:
+            flask_session[STICKY_KEY] = until
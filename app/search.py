@@ -0,0 +1,206 @@
+import heapq
+import math
+import re
+import threading
+import time
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import selectinload
+from app import db, app
+from models import Book, Genre, books_genres
+
+# Вес совпадения в зависимости от поля книги
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'author': 2.0,
+    'genres': 1.5,
+    'publisher': 1.0,
+    'short_desc': 1.0,
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower())
+            if len(token) > 1 or token.isdigit()]
+
+
+def book_fields(book):
+    return {
+        'name': book.name,
+        'author': book.author,
+        'publisher': book.publisher,
+        'short_desc': book.short_desc,
+        'genres': ' '.join(genre.name for genre in book.genres),
+    }
+
+
+# Инвертированный индекс в памяти процесса: термин -> {book_id: вес}.
+# Строится при первом поиске, обновляется при добавлении, изменении
+# и удалении книги и перестраивается раз в ttl секунд, чтобы
+# подхватить изменения из других воркеров
+class InvertedIndex:
+    name = 'memory'
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._postings = {}
+        self._documents = {}
+        self._built_at = None
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    def _weights(self, fields):
+        weights = {}
+        for field, text in fields.items():
+            for token in tokenize(text):
+                weights[token] = weights.get(token, 0) + FIELD_WEIGHTS[field]
+        return weights
+
+    def add_document(self, book_id, fields):
+        weights = self._weights(fields)
+        with self._lock:
+            self._remove(book_id)
+            for token, weight in weights.items():
+                self._postings.setdefault(token, {})[book_id] = weight
+            self._documents[book_id] = list(weights)
+
+    def _remove(self, book_id):
+        for token in self._documents.pop(book_id, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(book_id, None)
+                if not postings:
+                    del self._postings[token]
+
+    # Новый индекс собирается отдельно и подменяет старый целиком
+    def build(self, documents):
+        postings = {}
+        indexed = {}
+        for book_id, fields in documents:
+            weights = self._weights(fields)
+            for token, weight in weights.items():
+                postings.setdefault(token, {})[book_id] = weight
+            indexed[book_id] = list(weights)
+        with self._lock:
+            self._postings = postings
+            self._documents = indexed
+            self._built_at = time.monotonic()
+
+    def _expired(self):
+        return (self._built_at is None or (self.ttl and
+                self._built_at + self.ttl <= time.monotonic()))
+
+    # Индекс строит один поток. Пока идет перестройка, остальные
+    # ищут по прежнему индексу, а если его еще нет - ждут
+    def _ensure_built(self):
+        if not self._expired():
+            return
+        if not self._build_lock.acquire(blocking=self._built_at is None):
+            return
+        try:
+            if self._expired():
+                books = db.session.scalars(
+                    sa.select(Book).options(selectinload(Book.genres))
+                    .execution_options(yield_per=1000))
+                self.build((book.id, book_fields(book)) for book in books)
+        finally:
+            self._build_lock.release()
+
+    def update(self, book):
+        if self._built_at is not None:
+            self.add_document(book.id, book_fields(book))
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    # Все слова запроса должны встретиться в книге, последнее слово
+    # может быть началом слова. Ранжирование - сумма весов полей с idf
+    def search_ids(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            total = max(len(self._documents), 1)
+            scores = None
+            for i, token in enumerate(tokens):
+                if i == len(tokens) - 1 and token not in self._postings:
+                    matches = {}
+                    for term, postings in self._postings.items():
+                        if term.startswith(token):
+                            for book_id, weight in postings.items():
+                                matches[book_id] = max(
+                                    matches.get(book_id, 0), weight)
+                else:
+                    matches = self._postings.get(token, {})
+                idf = math.log(1 + total / (1 + len(matches)))
+                if scores is None:
+                    scores = {book_id: weight * idf
+                              for book_id, weight in matches.items()}
+                else:
+                    scores = {book_id: score + matches[book_id] * idf
+                              for book_id, score in scores.items()
+                              if book_id in matches}
+                if not scores:
+                    return []
+        ranked = heapq.nlargest(limit, scores.items(),
+                                key=lambda item: (item[1], item[0]))
+        return [book_id for book_id, _ in ranked]
+
+    def search(self, query, limit):
+        self._ensure_built()
+        return self.search_ids(query, limit)
+
+
+# Полнотекстовый поиск MySQL по индексу ix_books_fulltext
+# (name, author, publisher, short_desc) плюс совпадение по жанрам.
+# Индекс используется, только когда MATCH стоит прямо в WHERE, поэтому
+# кандидаты отбираются двумя запросами (по индексу и по названию жанра),
+# объединяются, и ранжируются только они
+class FullTextIndex:
+    name = 'fulltext'
+
+    def search(self, query, limit):
+        if not tokenize(query):
+            return []
+        relevance = mysql.match(Book.name, Book.author, Book.publisher,
+                                Book.short_desc,
+                                against=query).in_natural_language_mode()
+        by_text = (sa.select(Book.id.label('book_id'),
+                             relevance.label('relevance'),
+                             sa.literal(0.0).label('genre_bonus'))
+                   .where(relevance))
+        by_genre = (sa.select(books_genres.c.book_id, sa.literal(0.0),
+                              sa.literal(FIELD_WEIGHTS['genres']))
+                    .join(Genre, Genre.id == books_genres.c.genre_id)
+                    .where(Genre.name.contains(query, autoescape=True)))
+        candidates = sa.union_all(by_text, by_genre).subquery('candidates')
+        score = (sa.func.sum(candidates.c.relevance)
+                 + sa.func.max(candidates.c.genre_bonus))
+        rows = db.session.execute(
+            sa.select(candidates.c.book_id)
+            .group_by(candidates.c.book_id)
+            .order_by(score.desc(), candidates.c.book_id.desc())
+            .limit(limit))
+        return [row[0] for row in rows]
+
+    def update(self, book):
+        pass
+
+    def remove(self, book_id):
+        pass
+
+
+def create_search_index(flask_app):
+    backend = flask_app.config.get('SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        url = flask_app.config.get('SQLALCHEMY_DATABASE_URI', '')
+        backend = 'fulltext' if url.startswith('mysql') else 'memory'
+    if backend == 'fulltext':
+        return FullTextIndex()
+    return InvertedIndex(flask_app.config.get('SEARCH_INDEX_TTL', 300))
+
+
+search_index = create_search_index(app)
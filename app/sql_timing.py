@@ -0,0 +1,140 @@
+import functools
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+import sqlalchemy as sa
+from app import db, app
+
+slow_query_logger = logging.getLogger('slow_queries')
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+PARAM_RE = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+VALUES_RE = re.compile(r'\bVALUES\s*\([^()]*\)(?:\s*,\s*\([^()]*\))+',
+                       re.IGNORECASE)
+SPACE_RE = re.compile(r'\s+')
+
+
+# SQL без значений: запросы, отличающиеся только параметрами,
+# длиной списка IN (...) или числом строк VALUES, считаются одним
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(statement):
+    sql = STRING_RE.sub('?', statement)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = PARAM_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = VALUES_RE.sub('VALUES (...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+# Сводка по запросам за время работы процесса: число вызовов,
+# суммарное и максимальное время и страницы, с которых они шли
+class QueryStats:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def add(self, sql, duration, endpoint):
+        with self._lock:
+            item = self._data.get(sql)
+            if item is None:
+                if len(self._data) >= self.maxsize:
+                    return
+                item = self._data[sql] = {
+                    'sql': sql, 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'endpoints': Counter()}
+            item['calls'] += 1
+            item['total_ms'] += duration
+            item['max_ms'] = max(item['max_ms'], duration)
+            item['endpoints'][endpoint] += 1
+
+    def top(self, limit):
+        with self._lock:
+            items = [dict(item, endpoints=item['endpoints'].most_common(3))
+                     for item in self._data.values()]
+        items.sort(key=lambda item: item['total_ms'], reverse=True)
+        for item in items[:limit]:
+            item['avg_ms'] = item['total_ms'] / item['calls']
+        return items[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+query_stats = QueryStats(app.config.get('QUERY_STATS_SIZE', 500))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    duration = (time.perf_counter()
+                - conn.info['query_started'].pop()) * 1000
+    endpoint = None
+    if has_request_context():
+        endpoint = request.endpoint
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_ms = g.get('sql_ms', 0.0) + duration
+    sql = normalize_sql(statement)
+    query_stats.add(sql, duration, endpoint or '-')
+    if duration >= app.config.get('SLOW_QUERY_MS', 100):
+        slow_query_logger.warning(json.dumps({
+            'event': 'slow_query',
+            'endpoint': endpoint,
+            'duration_ms': round(duration, 2),
+            'sql': sql,
+        }, ensure_ascii=False))
+
+
+# Запрос завершился ошибкой: after_cursor_execute не будет
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+# Server-Timing: время запросов к базе и всей обработки запроса
+def _add_server_timing(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    total = (time.perf_counter() - started) * 1000
+    response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries"'
+                         % (g.get('sql_ms', 0.0), g.get('sql_count', 0)))
+    response.headers.add('Server-Timing', 'app;dur=%.2f' % total)
+    return response
+
+
+# Обработчики подключаются только при SQL_TIMING_ENABLED, без него
+# на запросы к базе и ответы ничего не навешивается
+def init_sql_timing(flask_app):
+    if not flask_app.config.get('SQL_TIMING_ENABLED', False):
+        return False
+    with flask_app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        sa.event.listen(engine, 'before_cursor_execute',
+                        _before_cursor_execute)
+        sa.event.listen(engine, 'after_cursor_execute',
+                        _after_cursor_execute)
+        sa.event.listen(engine, 'handle_error', _handle_error)
+    flask_app.before_request(_start_timer)
+    flask_app.after_request(_add_server_timing)
+    return True
+
+
+sql_timing_enabled = init_sql_timing(app)
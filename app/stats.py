@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+import click
+import sqlalchemy as sa
+from app import db, app
+from models import BookVisits, DailyBookVisits, BookVisitTotals
+from tool import upsert
+
+
+# Инкрементальное обновление посуточной сводки просмотров.
+# Вызывается в той же транзакции, что и вставка самих посещений
+def add_daily_visits(rows):
+    counts = Counter((row['book_id'], row['created_at'].date())
+                     for row in rows)
+    if not counts:
+        return
+    values = [{'book_id': book_id, 'day': day, 'visits': visits}
+              for (book_id, day), visits in counts.items()]
+    upsert(DailyBookVisits, values, ['book_id', 'day'],
+           lambda inserted: {
+               'visits': DailyBookVisits.visits + inserted.visits})
+
+
+# Инкрементальное обновление итогов просмотров по книгам
+def add_visit_totals(rows):
+    totals = {}
+    for row in rows:
+        item = totals.setdefault(row['book_id'], [0, 0, 0])
+        item[0] += 1
+        item[1 if row['user_id'] else 2] += 1
+    if not totals:
+        return
+    values = [{'book_id': book_id, 'visits': visits,
+               'auth_visits': auth_visits, 'anon_visits': anon_visits}
+              for book_id, (visits, auth_visits, anon_visits)
+              in sorted(totals.items())]
+    upsert(BookVisitTotals, values, ['book_id'],
+           lambda inserted: {
+               'visits': BookVisitTotals.visits + inserted.visits,
+               'auth_visits': BookVisitTotals.auth_visits + inserted.auth_visits,
+               'anon_visits': BookVisitTotals.anon_visits + inserted.anon_visits,
+           })
+
+
+# Самые просматриваемые книги за последние days дней.
+# Результат (список пар book_id, просмотры) недолго кешируется в процессе
+class TopBooksCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, days, limit):
+        key = (days, limit)
+        item = self._data.get(key)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        result = self._load(days, limit)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, result)
+        return result
+
+    def _load(self, days, limit):
+        start = date.today() - timedelta(days=days)
+        total = db.func.sum(DailyBookVisits.visits)
+        rows = (db.session
+                .query(DailyBookVisits.book_id, total)
+                .filter(DailyBookVisits.day >= start)
+                .group_by(DailyBookVisits.book_id)
+                .order_by(total.desc())
+                .limit(limit).all())
+        return [(book_id, int(visits)) for book_id, visits in rows]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+top_books = TopBooksCache(app.config.get('TOP_BOOKS_CACHE_TTL', 60))
+
+
+# Пересборка сводки по сырому журналу book_visits
+def rebuild_daily_visits():
+    day = db.func.date(BookVisits.created_at)
+    source = (sa.select(BookVisits.book_id, day, db.func.count(BookVisits.id))
+              .group_by(BookVisits.book_id, day))
+    db.session.execute(sa.delete(DailyBookVisits))
+    db.session.execute(sa.insert(DailyBookVisits).from_select(
+        ['book_id', 'day', 'visits'], source))
+    db.session.commit()
+    top_books.clear()
+
+
+@app.cli.command('backfill-visit-rollup')
+def backfill_visit_rollup():
+    """Пересобрать посуточную сводку просмотров книг."""
+    rebuild_daily_visits()
+    click.echo('Сводка book_visit_daily пересобрана: %d строк'
+               % DailyBookVisits.query.count())
+
+
+# Пересборка итогов по сырому журналу book_visits
+def rebuild_visit_totals():
+    anonymous = sa.case((BookVisits.user_id.is_(None), 1), else_=0)
+    source = (sa.select(BookVisits.book_id,
+                        db.func.count(BookVisits.id),
+                        db.func.count(BookVisits.user_id),
+                        db.func.sum(anonymous))
+              .group_by(BookVisits.book_id))
+    db.session.execute(sa.delete(BookVisitTotals))
+    db.session.execute(sa.insert(BookVisitTotals).from_select(
+        ['book_id', 'visits', 'auth_visits', 'anon_visits'], source))
+    db.session.commit()
+
+
+@app.cli.command('rebuild-visit-totals')
+def rebuild_visit_totals_command():
+    """Пересобрать итоги просмотров по книгам."""
+    rebuild_visit_totals()
+    click.echo('Итоги book_visit_totals пересобраны: %d строк'
+               % BookVisitTotals.query.count())
@@ -0,0 +1,97 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image as PILImage
+from app import app
+from files import temp_file, publish_file
+
+# Размеры уменьшенных копий обложек (ширина, высота)
+VARIANTS = {
+    'thumb': (300, 450),
+    'medium': (600, 900),
+}
+
+
+def variants_folder():
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'variants')
+
+
+def variant_file_name(file_name, size):
+    stem, ext = os.path.splitext(file_name)
+    return '%s_%s%s' % (stem, size, ext)
+
+
+# Выполняется в процессе пула, поэтому функция верхнего уровня
+# и получает только пути. Фоновая задача и запрос страницы могут
+# готовить одну копию одновременно, поэтому у каждого свой временный
+# файл, а готовая копия подменяется атомарно
+def render_variant(src, dst, box):
+    fd, tmp = temp_file(os.path.dirname(dst), prefix='.variant-')
+    try:
+        with os.fdopen(fd, 'wb') as out, PILImage.open(src) as img:
+            img.thumbnail(box)
+            img.save(out, format=img.format)
+        publish_file(tmp, dst)
+    except:
+        os.remove(tmp)
+        raise
+    return dst
+
+
+# Генерация копий: после загрузки - в пуле процессов,
+# для старых обложек - по первому запросу
+class ThumbnailGenerator:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def _paths(self, file_name, size):
+        return (os.path.join(app.config['UPLOAD_FOLDER'], file_name),
+                os.path.join(variants_folder(),
+                             variant_file_name(file_name, size)))
+
+    # Ошибка пула (например, BrokenProcessPool) не должна ломать загрузку:
+    # обложка уже сохранена, а копии подготовит ensure() по запросу
+    def schedule(self, file_name):
+        try:
+            os.makedirs(variants_folder(), exist_ok=True)
+            for size, box in VARIANTS.items():
+                src, dst = self._paths(file_name, size)
+                self._executor().submit(render_variant, src, dst, box)
+        except:
+            app.logger.exception('Не удалось запланировать уменьшение '
+                                 'обложки %s', file_name)
+            # Сломанный пул пересоздается при следующей загрузке
+            with self._lock:
+                pool, self._pool = self._pool, None
+            if pool is not None:
+                pool.shutdown(wait=False)
+
+    def ensure(self, file_name, size):
+        src, dst = self._paths(file_name, size)
+        if os.path.exists(dst):
+            return dst
+        try:
+            os.makedirs(variants_folder(), exist_ok=True)
+            return render_variant(src, dst, VARIANTS[size])
+        except (OSError, ValueError):
+            # Формат не поддерживается или файл поврежден -
+            # отдаем оригинал
+            app.logger.warning('Не удалось уменьшить обложку %s', file_name)
+            return None
+
+    def remove(self, file_name):
+        for size in VARIANTS:
+            _, dst = self._paths(file_name, size)
+            if os.path.exists(dst):
+                os.remove(dst)
+
+
+thumbnails = ThumbnailGenerator(app.config.get('THUMBNAIL_WORKERS', 2))
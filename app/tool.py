@@ -1,17 +1,86 @@
 import hashlib
+import json
+import threading
+import time
 import uuid
 import os
 from werkzeug.utils import secure_filename
+from collections import OrderedDict
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from models import Image
 from app import db, app
+from thumbnails import thumbnails
+from files import temp_file, publish_file
+
+# Кеш метаданных обложек: id -> (file_name, mime_type, md5_hash).
+# Файлы обложек не меняются, поэтому запись живет до удаления обложки
+class ImageMetaCache:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, image_id):
+        meta = self._data.get(image_id)
+        if meta is None:
+            img = db.session.get(Image, image_id)
+            if img is None:
+                return None
+            meta = (img.file_name, img.mime_type, img.md5_hash)
+            with self._lock:
+                self._data[image_id] = meta
+        return meta
+
+    def forget(self, image_id):
+        with self._lock:
+            self._data.pop(image_id, None)
+
+
+image_meta = ImageMetaCache()
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+# Потоковая запись загрузки во временный файл рядом с обложками.
+# Хеш считается по тем же кускам, что пишутся на диск, поэтому файл
+# читается один раз и целиком в памяти не оказывается
+def stream_to_file(stream, directory, max_size=None, chunk_size=64 * 1024):
+    md5 = hashlib.md5()
+    size = 0
+    fd, path = temp_file(directory, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise ImageTooLarge(size)
+                md5.update(chunk)
+                out.write(chunk)
+    except:
+        os.remove(path)
+        raise
+    return path, md5.hexdigest(), size
+
 
 class ImageSaver:
     def __init__(self, file):
         self.file = file
 
     def save(self):
+        folder = app.config['UPLOAD_FOLDER']
+        tmp_path, self.md5_hash, _ = stream_to_file(
+            self.file.stream, folder,
+            max_size=app.config.get('MAX_IMAGE_SIZE'),
+            chunk_size=app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024))
         self.img = self.__find_by_md5_hash()
         if self.img is not None:
+            # Такая обложка уже есть, копия не нужна
+            os.remove(tmp_path)
             return self.img
         _, file_extension = os.path.splitext(self.file.filename)
         uniq_id_name = str(uuid.uuid4())
@@ -20,14 +89,196 @@ class ImageSaver:
             file_name=uniq_id_name + file_extension,
             mime_type=self.file.mimetype,
             md5_hash=self.md5_hash)
-        self.file.save(
-            os.path.join(app.config['UPLOAD_FOLDER'],
-                         self.img.file_name))
-        db.session.add(self.img)
-        db.session.commit()
+        path = os.path.join(folder, self.img.file_name)
+        publish_file(tmp_path, path)
+        try:
+            db.session.add(self.img)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            os.remove(path)
+            # Ту же обложку только что сохранила параллельная загрузка
+            self.img = self.__find_by_md5_hash()
+            if self.img is None:
+                raise
+            return self.img
+        except:
+            db.session.rollback()
+            os.remove(path)
+            raise
+        # Уменьшенные копии готовятся в фоне
+        thumbnails.schedule(self.img.file_name)
         return self.img
 
     def __find_by_md5_hash(self):
-        self.md5_hash = hashlib.md5(self.file.read()).hexdigest()
-        self.file.seek(0)
         return Image.query.filter(Image.md5_hash == self.md5_hash).first()
+
+
+# INSERT ... ON DUPLICATE KEY UPDATE (ON CONFLICT) для поддерживаемых СУБД.
+# update получает псевдотаблицу вставляемых значений и возвращает
+# словарь колонок для обновления существующей строки
+def upsert(model, values, index_elements, update):
+    table = model.__table__
+    dialect = db.session.get_bind(mapper=model).dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(values)
+        return db.session.execute(
+            stmt.on_duplicate_key_update(**update(stmt.inserted)))
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).values(values)
+        return db.session.execute(stmt.on_conflict_do_update(
+            index_elements=index_elements, set_=update(stmt.excluded)))
+    raise NotImplementedError('upsert is not supported for %s' % dialect)
+
+
+# Кеш в памяти процесса: LRU на maxsize записей, у каждой свой ttl
+class TTLCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Тот же интерфейс поверх внешнего key-value сервера (get/set/delete
+# как у redis), общий для воркеров. Значения хранятся в JSON
+class SharedTTLCache:
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        return '%s:%s' % (self.prefix, key)
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self._key(key), json.dumps(value), ex=int(ttl))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+
+# Локальная замена внешнего key-value сервера (интерфейс как у redis:
+# get(key) и set(key, value, ex=ttl), отсортированные множества и
+# pipeline), чтобы общие кеши работали без него
+class LocalKVClient:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self._data[key] = (value, time.time() + (ex or 0))
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def exists(self, key):
+        return int(self.get(key) is not None)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            value = self.get(key)
+            if value is None:
+                return False
+            self._data[key] = (value, time.time() + seconds)
+            return True
+
+    # Отсортированное множество: словарь элемент -> score
+    def _zset(self, key):
+        value = self.get(key)
+        if value is None:
+            value = {}
+            self._data[key] = (value, float('inf'))
+        return value
+
+    def zadd(self, key, mapping):
+        with self._lock:
+            zset = self._zset(key)
+            added = len(set(mapping) - set(zset))
+            zset.update(mapping)
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            zset = self._zset(key)
+            return sum(zset.pop(member, None) is not None
+                       for member in members)
+
+    def zremrangebyscore(self, key, min, max):
+        with self._lock:
+            zset = self._zset(key)
+            removed = [member for member, score in zset.items()
+                       if float(min) <= score <= float(max)]
+            for member in removed:
+                del zset[member]
+            return len(removed)
+
+    def zcard(self, key):
+        with self._lock:
+            value = self.get(key)
+            return len(value) if value else 0
+
+    def pipeline(self, transaction=True):
+        return LocalKVPipeline(self)
+
+
+# Команды pipeline выполняются разом под блокировкой клиента,
+# как MULTI/EXEC в redis
+class LocalKVPipeline:
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def command(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        with self.client._lock:
+            results = [method(*args, **kwargs)
+                       for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
@@ -1,23 +1,71 @@
 from flask_login import current_user
 
 
+# Правила, зависящие от конкретной записи, не попадают в таблицу прав
+# и вычисляются при каждом вызове
+def record_dependent(method):
+    method.record_dependent = True
+    return method
+
+
 class UsersPolicy:
-    def __init__(self, record):
+    def __init__(self, record, user=None):
         self.record = record
+        self.user = user if user is not None else current_user
 
     def create(self):
-        return current_user.is_admin()
+        return self.user.is_admin()
 
     def review(self):
-        return (current_user.is_admin()
-                or current_user.is_moderator()
-                or current_user.is_user())
+        return (self.user.is_admin()
+                or self.user.is_moderator()
+                or self.user.is_user())
 
     def get_logs(self):
-        return current_user.is_admin()
+        return self.user.is_admin()
 
     def delete(self):
-        return current_user.is_admin()
+        return self.user.is_admin()
 
     def edit(self):
-        return current_user.is_admin() or current_user.is_moderator()
+        return self.user.is_admin() or self.user.is_moderator()
+
+
+def policy_actions():
+    return [name for name, value in vars(UsersPolicy).items()
+            if callable(value) and not name.startswith('_')]
+
+
+# Таблица роль -> действие -> разрешено, собирается один раз при старте
+# из правил UsersPolicy
+class PermissionMatrix:
+    def __init__(self):
+        self._table = {}
+        self._dependent = set()
+
+    def compile(self, role_user, role_ids):
+        self._table = {}
+        self._dependent = {name for name in policy_actions()
+                           if getattr(getattr(UsersPolicy, name),
+                                      'record_dependent', False)}
+        for role_id in role_ids:
+            self._compile_role(role_user(role_id))
+
+    def _compile_role(self, user):
+        policy = UsersPolicy(None, user)
+        self._table[user.role_id] = {
+            name: bool(getattr(policy, name)())
+            for name in policy_actions() if name not in self._dependent}
+        return self._table[user.role_id]
+
+    def allowed(self, user, action, record=None):
+        if action in self._dependent:
+            return bool(getattr(UsersPolicy(record, user), action)())
+        actions = self._table.get(user.role_id)
+        if actions is None:
+            # Роль, не известная на момент старта
+            actions = self._compile_role(user)
+        return actions.get(action, False)
+
+
+permission_matrix = PermissionMatrix()
@@ -0,0 +1,130 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from app import db, app
+from models import BookVisits
+from tool import LocalKVClient
+
+
+def cap_key(user_id, book_id):
+    return 'visit_cap:%s:%s' % (user_id or 'anon', book_id)
+
+
+# Хранилище счетчиков внутри процесса.
+# Ключи, у которых все отметки вышли за окно, вычищаются периодически
+class MemoryCapStore:
+    def __init__(self, ttl, sweep_interval=60):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._data = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def exists(self, key):
+        return key in self._data
+
+    # Проверка и добавление отметки под одной блокировкой
+    def hit(self, key, now, window, limit, seed=()):
+        with self._lock:
+            stamps = self._data.get(key)
+            if stamps is None:
+                stamps = list(seed)
+            border = now - window
+            stamps = [t for t in stamps if t > border]
+            allowed = len(stamps) < limit
+            if allowed:
+                stamps.append(now)
+            self._data[key] = stamps
+            if time.monotonic() >= self._next_sweep:
+                self._sweep()
+        return allowed
+
+    def _sweep(self):
+        border = time.time() - self.ttl
+        for key in [k for k, v in self._data.items() if not v or v[-1] <= border]:
+            self._data.pop(key, None)
+        self._next_sweep = time.monotonic() + self.sweep_interval
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Хранилище счетчиков во внешнем сервере, общем для всех воркеров.
+# Отметки лежат в отсортированном множестве (score - время), очистка
+# окна, добавление и подсчет идут одной транзакцией (MULTI/EXEC),
+# поэтому параллельные воркеры не пропустят больше limit просмотров
+class SharedCapStore:
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    def exists(self, key):
+        return bool(self.client.exists(key))
+
+    def hit(self, key, now, window, limit, seed=()):
+        member = '%.6f:%s' % (now, uuid.uuid4().hex)
+        pipe = self.client.pipeline(transaction=True)
+        if seed:
+            # Одинаковые имена у отметок из базы: повторное заполнение
+            # из другого воркера их не удвоит
+            pipe.zadd(key, {'seed:%d' % i: t for i, t in enumerate(seed)})
+        pipe.zremrangebyscore(key, '-inf', now - window)
+        pipe.zadd(key, {member: now})
+        pipe.zcard(key)
+        pipe.expire(key, int(self.ttl) + 1)
+        count = pipe.execute()[-2]
+        if count <= limit:
+            return True
+        # Отказ: своя отметка убирается и не продлевает лимит
+        self.client.zrem(key, member)
+        return False
+
+
+# Ограничение числа учитываемых просмотров книги одним пользователем
+# за скользящее окно. В хранилище лежит не больше limit отметок времени
+class VisitCap:
+    def __init__(self, store, limit, window):
+        self.store = store
+        self.limit = limit
+        self.window = window
+
+    def _count_in_db(self, user_id, book_id, now):
+        start = datetime.fromtimestamp(now) - timedelta(seconds=self.window)
+        query = (db.session
+                 .query(db.func.count(BookVisits.id),
+                        db.func.max(BookVisits.created_at))
+                 .filter(BookVisits.book_id == book_id)
+                 .filter(start <= BookVisits.created_at))
+        if user_id:
+            query = query.filter(BookVisits.user_id == user_id)
+        else:
+            query = query.filter(BookVisits.user_id.is_(None))
+        count, last_visit = query.one()
+        if not count:
+            return []
+        # Точные отметки неизвестны, поэтому берем самую позднюю:
+        # лимит отпустит не раньше, чем это сделал бы запрос к базе
+        return [last_visit.timestamp()] * min(count, self.limit)
+
+    def allow(self, user_id, book_id):
+        key = cap_key(user_id, book_id)
+        now = time.time()
+        seed = ()
+        if not self.store.exists(key):
+            seed = self._count_in_db(user_id, book_id, now)
+        return self.store.hit(key, now, self.window, self.limit, seed)
+
+
+def create_visit_cap(flask_app):
+    limit = flask_app.config.get('VISIT_CAP_LIMIT', 10)
+    window = flask_app.config.get('VISIT_CAP_WINDOW', 24 * 60 * 60)
+    if flask_app.config.get('VISIT_CAP_BACKEND', 'memory') == 'shared':
+        client = flask_app.config.get('VISIT_CAP_CLIENT') or LocalKVClient()
+        store = SharedCapStore(client, window)
+    else:
+        store = MemoryCapStore(window)
+    return VisitCap(store, limit, window)
+
+
+visit_cap = create_visit_cap(app)
@@ -0,0 +1,201 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+import sqlalchemy as sa
+from app import db, app
+from models import BookVisits
+from stats import add_daily_visits, add_visit_totals
+
+
+# Запись пачки посещений в book_visits одним INSERT
+# вместе с обновлением сводок. Вставка идет в таблицу, а не в модель:
+# ORM делит пачку на части по набору непустых полей, и просмотры
+# анонимных (user_id = NULL) и вошедших пользователей вперемешку
+# превращались бы в отдельный INSERT на строку
+def write_visits(rows):
+    if not rows:
+        return
+    db.session.execute(sa.insert(BookVisits.__table__), rows)
+    add_daily_visits(rows)
+    add_visit_totals(rows)
+    db.session.commit()
+
+
+def make_visit(user_id, book_id):
+    # Время фиксируем в момент просмотра, а не в момент записи в базу
+    return {
+        'user_id': user_id,
+        'book_id': book_id,
+        'created_at': datetime.now(),
+    }
+
+
+# Синхронная запись: одна транзакция на каждый просмотр
+class SyncVisitWriter:
+    mode = 'sync'
+
+    def __init__(self):
+        self.written = 0
+        self.failed = 0
+        self.last_flush_ms = None
+
+    def record(self, user_id, book_id):
+        started = time.perf_counter()
+        try:
+            write_visits([make_visit(user_id, book_id)])
+            self.written += 1
+        except:
+            db.session.rollback()
+            self.failed += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'queue_depth': 0,
+            'written': self.written,
+            'failed': self.failed,
+            'last_flush_ms': self.last_flush_ms,
+        }
+
+
+# Отложенная запись: просмотры складываются в ограниченную очередь,
+# фоновый поток вставляет их пачками по размеру или по таймеру
+class BufferedVisitWriter:
+    mode = 'buffered'
+
+    def __init__(self, flask_app, maxsize, batch_size, flush_interval,
+                 put_timeout):
+        self.app = flask_app
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.failed = 0
+        self.overflow = 0
+        self.flushes = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        # После fork воркера поток родителя не наследуется,
+        # поэтому проверяем еще и pid
+        if (self._thread is not None and self._thread.is_alive()
+                and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if (self._thread is None or not self._thread.is_alive()
+                    or self._pid != os.getpid()):
+                self._stop.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                                                name='visits-flusher',
+                                                daemon=True)
+                self._thread.start()
+
+    def record(self, user_id, book_id):
+        self._ensure_started()
+        row = make_visit(user_id, book_id)
+        try:
+            self.queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            # Очередь переполнена: запрос сам платит за запись,
+            # тем самым притормаживая входящий поток
+            self.overflow += 1
+            self._flush([row])
+
+    def _take_batch(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                write_visits(batch)
+                self.written += len(batch)
+            except:
+                db.session.rollback()
+                # Одна битая строка не должна терять всю пачку
+                for row in batch:
+                    try:
+                        write_visits([row])
+                        self.written += 1
+                    except:
+                        db.session.rollback()
+                        self.failed += 1
+        elapsed = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms or 0, elapsed)
+        self.app.logger.debug('Записано посещений: %d за %.1f мс, в очереди %d',
+                              len(batch), elapsed, self.queue.qsize())
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        # Гарантированно дописываем все, что осталось в очереди
+        batch = self._drain()
+        while batch:
+            self._flush(batch[:self.batch_size])
+            batch = batch[self.batch_size:]
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'written': self.written,
+            'failed': self.failed,
+            'overflow': self.overflow,
+            'flushes': self.flushes,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+        }
+
+
+def create_visit_writer(flask_app):
+    if flask_app.config.get('VISITS_WRITE_MODE', 'sync') == 'buffered':
+        return BufferedVisitWriter(
+            flask_app,
+            maxsize=flask_app.config.get('VISITS_QUEUE_SIZE', 10000),
+            batch_size=flask_app.config.get('VISITS_BATCH_SIZE', 500),
+            flush_interval=flask_app.config.get('VISITS_FLUSH_INTERVAL', 1.0),
+            put_timeout=flask_app.config.get('VISITS_PUT_TIMEOUT', 0.05))
+    return SyncVisitWriter()
+
+
+visit_writer = create_visit_writer(app)
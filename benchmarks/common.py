@@ -0,0 +1,92 @@
+"""Общие части бенчмарков: подключение приложения, статистика
+задержек и сохранение результатов в JSON.
+"""
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+APP_DIR = os.path.join(ROOT_DIR, 'app')
+# Пути из аргументов считаются от каталога запуска
+START_DIR = os.getcwd()
+sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.dialects.mysql import YEAR  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from sqlalchemy.ext.compiler import compiles  # noqa: E402
+
+
+# Тип YEAR есть только в MySQL, для локальной базы SQLite это целое
+@compiles(YEAR, 'sqlite')
+def _compile_year_sqlite(type_, compiler, **kw):
+    return 'INTEGER'
+
+
+# Без WAL в SQLite читатели и писатели блокируют друг друга, и под
+# параллельной нагрузкой измерялись бы блокировки файла базы
+@event.listens_for(Engine, 'connect')
+def _sqlite_wal(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA busy_timeout=30000')
+        cursor.close()
+
+
+from app import app, db  # noqa: E402,F401
+
+BENCH_PASSWORD = 'bench'
+ADMIN_LOGIN = 'bench_admin'
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def at(share):
+        return values[min(len(values) - 1, int(len(values) * share))]
+
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values),
+        'p50_ms': at(0.5),
+        'p95_ms': at(0.95),
+        'p99_ms': at(0.99),
+        'max_ms': values[-1],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Результат с описанием окружения, чтобы сравнивать прогоны
+# между коммитами
+def write_result(name, result, output=None):
+    with app.app_context():
+        database = db.engine.dialect.name
+    document = {
+        'benchmark': name,
+        'revision': git_revision(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'database': database,
+        'result': result,
+    }
+    text = json.dumps(document, indent=2, ensure_ascii=False)
+    if output:
+        with open(os.path.join(START_DIR, output), 'w') as f:
+            f.write(text + '\n')
+    print(text)
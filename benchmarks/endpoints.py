@@ -0,0 +1,105 @@
+"""Задержка основных страниц через тестовый клиент Flask: каталог,
+страница книги, поиск и журналы администратора. Для каждой страницы
+считаются перцентили времени ответа, запросы в секунду и число
+SQL-запросов на один ответ.
+
+Данные готовит generate_data.py. Запуск из корня:
+
+    python benchmarks/endpoints.py --requests 200 --output endpoints.json
+"""
+import argparse
+import random
+import time
+
+import sqlalchemy as sa
+
+from common import (app, db, percentiles, write_result, ADMIN_LOGIN,
+                    BENCH_PASSWORD)
+from models import Book
+
+QUERIES = []
+
+
+def count_queries(conn, cursor, statement, parameters, context, executemany):
+    QUERIES.append(statement)
+
+
+def scenarios(book_ids, rng):
+    words = ['война', 'море', 'толстой', 'ист', 'город сад']
+    return {
+        'index': lambda: '/',
+        'index_page_3': lambda: '/?page=3',
+        'show': lambda: '/%d' % rng.choice(book_ids),
+        'search': lambda: '/search?q=%s' % rng.choice(words),
+        'users_statistics': lambda: '/logs/users_statistics',
+        'users_statistics_page_3': lambda: '/logs/users_statistics?page=3',
+        'books_statistics': lambda: '/logs/books_statistics',
+    }
+
+
+def measure(client, make_url, requests, warmup):
+    for _ in range(warmup):
+        client.get(make_url())
+    timings = []
+    queries = []
+    statuses = {}
+    started = time.perf_counter()
+    for _ in range(requests):
+        url = make_url()
+        QUERIES.clear()
+        request_started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - request_started) * 1000)
+        queries.append(len(QUERIES))
+        statuses[response.status_code] = statuses.get(
+            response.status_code, 0) + 1
+    seconds = time.perf_counter() - started
+    result = percentiles(timings)
+    result['rps'] = requests / seconds
+    result['queries_per_request'] = sum(queries) / len(queries)
+    result['statuses'] = {str(code): count
+                          for code, count in sorted(statuses.items())}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--only', nargs='*',
+                        help='имена сценариев, по умолчанию все')
+    parser.add_argument('--anonymous', action='store_true',
+                        help='без входа администратора (журналы недоступны)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    with app.app_context():
+        book_ids = [row[0] for row in db.session.execute(
+            sa.select(Book.id).order_by(Book.id))]
+        sa.event.listen(db.engine, 'before_cursor_execute', count_queries)
+    if not book_ids:
+        raise SystemExit('В базе нет книг, сначала запустите generate_data.py')
+
+    client = app.test_client()
+    if not args.anonymous:
+        client.post('/auth/login', data={'login': ADMIN_LOGIN,
+                                         'password': BENCH_PASSWORD})
+    results = {}
+    for name, make_url in scenarios(book_ids, rng).items():
+        if args.only and name not in args.only:
+            continue
+        if args.anonymous and 'statistics' in name:
+            continue
+        results[name] = measure(client, make_url, args.requests, args.warmup)
+
+    write_result('endpoints', {
+        'requests': args.requests,
+        'anonymous': args.anonymous,
+        'books': len(book_ids),
+        'scenarios': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
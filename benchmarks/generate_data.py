@@ -0,0 +1,264 @@
+"""Генератор синтетических данных для бенчмарков: книги, пользователи,
+рецензии, журнал просмотров и история последних книг. При одинаковом
+--seed получаются одинаковые данные.
+
+Работает с базой из config.py приложения и только добавляет строки.
+Для пустой локальной базы SQLite можно создать схему флагом
+--create-schema. Запуск из корня:
+
+    python benchmarks/generate_data.py --create-schema \\
+        --books 10000 --users 2000 --reviews 50000 --visits 2000000
+
+Пользователи входят с паролем "bench", администратор - bench_admin.
+"""
+import argparse
+import hashlib
+import io
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+
+from common import app, db, write_result, BENCH_PASSWORD, ADMIN_LOGIN
+from models import (Book, Genre, Image, Review, Role, User, BookVisits,
+                    LastBookVisits, books_genres, RATING_VALUES)
+from markup import render_markdown
+from ratings import rebuild_ratings
+from stats import rebuild_daily_visits, rebuild_visit_totals
+
+WORDS = ['война', 'мир', 'море', 'ночь', 'город', 'дом', 'сад', 'путь',
+         'свет', 'тень', 'зима', 'лето', 'река', 'огонь', 'ветер', 'звезда',
+         'время', 'память', 'сон', 'берег', 'история', 'тайна', 'остров',
+         'дорога', 'песня', 'небо', 'лес', 'поле', 'письмо', 'окно']
+AUTHORS = ['Толстой', 'Чехов', 'Пушкин', 'Гоголь', 'Булгаков', 'Бунин',
+           'Тургенев', 'Лермонтов', 'Куприн', 'Платонов', 'Набоков',
+           'Пастернак', 'Ахматова', 'Цветаева', 'Шолохов', 'Горький']
+GENRES = ['Роман', 'Повесть', 'Поэзия', 'Фантастика', 'Детектив',
+          'Драма', 'Приключения', 'Биография', 'Мемуары', 'Сказки']
+# Распределение оценок в рецензиях, 0..5
+RATING_WEIGHTS = [2, 3, 8, 20, 35, 32]
+
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def insert_rows(table, rows, batch):
+    for start in range(0, len(rows), batch):
+        db.session.execute(sa.insert(table), rows[start:start + batch])
+        db.session.commit()
+
+
+def sentence(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def ensure_roles():
+    names = {'ADMIN_ROLE_ID': 'admin', 'MODERATOR_ROLE_ID': 'moderator',
+             'USER_ROLE_ID': 'user'}
+    for key, name in names.items():
+        role_id = app.config[key]
+        if db.session.get(Role, role_id) is None:
+            db.session.add(Role(id=role_id, name=name, description=name))
+    db.session.commit()
+
+
+def ensure_genres():
+    existing = {genre.name: genre.id for genre in Genre.query}
+    for name in GENRES:
+        if name not in existing:
+            db.session.add(Genre(name=name))
+    db.session.commit()
+    return [genre.id for genre in Genre.query.order_by(Genre.id)]
+
+
+# Одна обложка на все книги: файл в UPLOAD_FOLDER и запись в images
+def ensure_cover():
+    try:
+        from PIL import Image as PILImage
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (600, 900), (90, 110, 140)).save(buffer, 'PNG')
+        data = buffer.getvalue()
+    except ImportError:
+        data = b'\x89PNG\r\n\x1a\n'
+    md5_hash = hashlib.md5(data).hexdigest()
+    image = Image.query.filter_by(md5_hash=md5_hash).first()
+    if image is not None:
+        return image.id
+    image = Image(id='bench-cover', file_name='bench-cover.png',
+                  mime_type='image/png', md5_hash=md5_hash)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with open(os.path.join(app.config['UPLOAD_FOLDER'],
+                           image.file_name), 'wb') as f:
+        f.write(data)
+    db.session.add(image)
+    db.session.commit()
+    return image.id
+
+
+def generate_users(rng, count, batch):
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    rows = []
+    if User.query.filter_by(login=ADMIN_LOGIN).first() is None:
+        rows.append({'login': ADMIN_LOGIN, 'password_hash': password_hash,
+                     'last_name': 'Bench', 'first_name': 'Admin',
+                     'middle_name': None,
+                     'role_id': app.config['ADMIN_ROLE_ID']})
+    first_id = next_id(User)
+    role_ids = [app.config['USER_ROLE_ID']] * 9 + [
+        app.config['MODERATOR_ROLE_ID']]
+    for user_id in range(first_id, first_id + count):
+        rows.append({'login': 'bench_user_%d' % user_id,
+                     'password_hash': password_hash,
+                     'last_name': rng.choice(AUTHORS), 'first_name': 'User',
+                     'middle_name': None, 'role_id': rng.choice(role_ids)})
+    insert_rows(User.__table__, rows, batch)
+    return [row[0] for row in db.session.execute(
+        sa.select(User.id).where(User.login.like('bench_user_%')))]
+
+
+def generate_books(rng, count, genre_ids, image_id, batch):
+    first_id = next_id(Book)
+    rows = []
+    links = []
+    for book_id in range(first_id, first_id + count):
+        short_desc = '%s **%s**. %s' % (sentence(rng, 12).capitalize(),
+                                        rng.choice(WORDS),
+                                        sentence(rng, 25).capitalize())
+        rows.append({
+            'id': book_id,
+            'name': '%s %d' % (sentence(rng, 3).capitalize(), book_id),
+            'short_desc': short_desc,
+            'short_desc_html': render_markdown(short_desc),
+            'year_release': rng.randint(1901, 2023),
+            'publisher': 'Издательство %d' % rng.randint(1, 50),
+            'author': rng.choice(AUTHORS),
+            'pages_volume': rng.randint(50, 1200),
+            'image_id': image_id,
+            'rating_sum': 0, 'rating_num': 0,
+            'rating_0': 0, 'rating_1': 0, 'rating_2': 0,
+            'rating_3': 0, 'rating_4': 0, 'rating_5': 0,
+        })
+        for genre_id in rng.sample(genre_ids, rng.randint(1, 3)):
+            links.append({'book_id': book_id, 'genre_id': genre_id})
+    insert_rows(Book.__table__, rows, batch)
+    insert_rows(books_genres, links, batch)
+    return list(range(first_id, first_id + count))
+
+
+# Популярность книг неравномерна: небольшая часть каталога собирает
+# большую часть просмотров и рецензий
+def popular_choice(rng, items, skew):
+    return items[int(len(items) * rng.random() ** skew)]
+
+
+def generate_reviews(rng, count, book_ids, user_ids, skew, batch):
+    count = min(count, len(book_ids) * len(user_ids))
+    pairs = set()
+    while len(pairs) < count:
+        pairs.add((popular_choice(rng, book_ids, skew), rng.choice(user_ids)))
+    now = datetime.now()
+    rows = []
+    for book_id, user_id in sorted(pairs):
+        text = sentence(rng, rng.randint(5, 40)).capitalize()
+        rows.append({
+            'book_id': book_id, 'user_id': user_id,
+            'rating': rng.choices(RATING_VALUES, RATING_WEIGHTS)[0],
+            'text': text, 'text_html': render_markdown(text),
+            'created_at': now - timedelta(minutes=rng.randint(0, 525600)),
+        })
+    insert_rows(Review.__table__, rows, batch)
+    return len(rows)
+
+
+def generate_visits(rng, count, book_ids, user_ids, days, skew, batch):
+    now = datetime.now()
+    seconds = days * 24 * 60 * 60
+    done = 0
+    while done < count:
+        size = min(batch, count - done)
+        rows = [{
+            'user_id': rng.choice(user_ids),
+            'book_id': popular_choice(rng, book_ids, skew),
+            'created_at': now - timedelta(seconds=rng.randint(0, seconds)),
+        } for _ in range(size)]
+        db.session.execute(sa.insert(BookVisits.__table__), rows)
+        db.session.commit()
+        done += size
+    return done
+
+
+def generate_history(rng, book_ids, user_ids, size, skew, batch):
+    now = datetime.now()
+    rows = []
+    for user_id in user_ids:
+        books = {popular_choice(rng, book_ids, skew) for _ in range(size)}
+        for position, book_id in enumerate(books):
+            rows.append({'user_id': user_id, 'book_id': book_id,
+                         'created_at': now - timedelta(minutes=position)})
+    insert_rows(LastBookVisits.__table__, rows, batch)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--reviews', type=int, default=50000)
+    parser.add_argument('--visits', type=int, default=1000000)
+    parser.add_argument('--history', type=int, default=5,
+                        help='последних книг на пользователя')
+    parser.add_argument('--days', type=int, default=180,
+                        help='глубина журнала просмотров в днях')
+    parser.add_argument('--skew', type=float, default=2.0,
+                        help='неравномерность популярности книг')
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--create-schema', action='store_true')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    timings = {}
+
+    def step(name, function, *function_args):
+        started = time.perf_counter()
+        value = function(*function_args)
+        timings[name] = time.perf_counter() - started
+        return value
+
+    with app.app_context():
+        if args.create_schema:
+            db.create_all()
+        ensure_roles()
+        genre_ids = ensure_genres()
+        image_id = ensure_cover()
+        user_ids = step('users', generate_users, rng, args.users, args.batch)
+        book_ids = step('books', generate_books, rng, args.books, genre_ids,
+                        image_id, args.batch)
+        reviews = step('reviews', generate_reviews, rng, args.reviews,
+                       book_ids, user_ids, args.skew, args.batch)
+        visits = step('visits', generate_visits, rng, args.visits, book_ids,
+                      user_ids, args.days, args.skew, args.batch)
+        history = step('history', generate_history, rng, book_ids, user_ids,
+                       args.history, args.skew, args.batch)
+        # Сводные данные пересчитываются по сгенерированным строкам
+        step('ratings', rebuild_ratings)
+        step('daily_visits', rebuild_daily_visits)
+        step('visit_totals', rebuild_visit_totals)
+
+    write_result('generate_data', {
+        'seed': args.seed,
+        'users': len(user_ids),
+        'books': len(book_ids),
+        'reviews': reviews,
+        'visits': visits,
+        'history': history,
+        'seconds': timings,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
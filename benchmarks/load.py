@@ -0,0 +1,146 @@
+"""Параллельная нагрузка на приложение: несколько потоков в течение
+заданного времени запрашивают страницы в случайном порядке с заданными
+весами. Без --url запросы идут через тестовый клиент Flask в этом же
+процессе, с --url - по HTTP к запущенному серверу.
+
+Данные готовит generate_data.py. Запуск из корня:
+
+    python benchmarks/load.py --workers 8 --duration 30
+    python benchmarks/load.py --url http://127.0.0.1:5000 --workers 32
+"""
+import argparse
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode
+
+import sqlalchemy as sa
+
+from common import (app, db, percentiles, write_result, ADMIN_LOGIN,
+                    BENCH_PASSWORD)
+from models import Book
+
+# Доля запросов каждого вида
+MIX = [
+    ('index', 40),
+    ('show', 45),
+    ('search', 10),
+    ('users_statistics', 3),
+    ('books_statistics', 2),
+]
+
+
+def make_url(name, book_ids, rng):
+    if name == 'index':
+        return '/?page=%d' % rng.randint(1, 3)
+    if name == 'show':
+        return '/%d' % rng.choice(book_ids)
+    if name == 'search':
+        return '/search?q=%s' % rng.choice(['война', 'море', 'ист'])
+    return '/logs/%s' % name
+
+
+class TestClientSession:
+    def __init__(self, admin):
+        self.client = app.test_client()
+        if admin:
+            self.client.post('/auth/login', data={
+                'login': ADMIN_LOGIN, 'password': BENCH_PASSWORD})
+
+    def get(self, url):
+        return self.client.get(url).status_code
+
+
+class HttpSession:
+    def __init__(self, base_url, admin):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()))
+        if admin:
+            data = urlencode({'login': ADMIN_LOGIN,
+                              'password': BENCH_PASSWORD}).encode()
+            self.opener.open(self.base_url + '/auth/login', data).read()
+
+    def get(self, url):
+        try:
+            with self.opener.open(self.base_url + url) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+
+def worker(session, book_ids, seed, deadline, samples):
+    rng = random.Random(seed)
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            status = session.get(make_url(name, book_ids, rng))
+        except Exception:
+            status = 'error'
+        samples.append((name, (time.perf_counter() - started) * 1000, status))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--url', help='адрес запущенного приложения')
+    parser.add_argument('--anonymous', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    with app.app_context():
+        book_ids = [row[0] for row in db.session.execute(
+            sa.select(Book.id).order_by(Book.id))]
+    if not book_ids:
+        raise SystemExit('В базе нет книг, сначала запустите generate_data.py')
+    if args.anonymous:
+        MIX[:] = [item for item in MIX if 'statistics' not in item[0]]
+
+    sessions = [HttpSession(args.url, not args.anonymous) if args.url
+                else TestClientSession(not args.anonymous)
+                for _ in range(args.workers)]
+    samples = []
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=worker,
+                                args=(session, book_ids, args.seed + number,
+                                      deadline, samples))
+               for number, session in enumerate(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    scenarios = {}
+    for name, _ in MIX:
+        own = [sample for sample in samples if sample[0] == name]
+        result = percentiles([sample[1] for sample in own])
+        result['rps'] = len(own) / seconds
+        result['errors'] = sum(1 for sample in own
+                               if sample[2] == 'error' or sample[2] >= 500)
+        scenarios[name] = result
+    total = percentiles([sample[1] for sample in samples])
+    total['rps'] = len(samples) / seconds
+    total['errors'] = sum(result['errors'] for result in scenarios.values())
+
+    write_result('load', {
+        'target': args.url or 'test_client',
+        'workers': args.workers,
+        'duration': seconds,
+        'anonymous': args.anonymous,
+        'total': total,
+        'scenarios': scenarios,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Микробенчмарк проверки прав: прежний UsersPolicy на каждый вызов
+против таблицы прав PermissionMatrix. Отдельно измеряется User.can,
+который после первого вызова отвечает из памяти запроса.
+
+Нужен config.py приложения (база не используется). Запуск из корня:
+
+    python benchmarks/permissions.py --calls 100000
+"""
+import argparse
+import timeit
+
+from flask import g
+
+from common import app, write_result
+from models import User
+from users_policy import UsersPolicy, permission_matrix
+
+
+def legacy_can(user, action, record=None):
+    # Прежняя реализация User.can
+    method = getattr(UsersPolicy(record, user), action, None)
+    if method:
+        return method()
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    actions = ['edit', 'delete', 'create', 'get_logs', 'review']
+    results = []
+    with app.test_request_context():
+        for role in ('ADMIN_ROLE_ID', 'MODERATOR_ROLE_ID', 'USER_ROLE_ID'):
+            user = User(id=1, role_id=app.config[role])
+            g._login_user = user
+            legacy = timeit.timeit(
+                lambda: [legacy_can(user, a) for a in actions],
+                number=args.calls // len(actions))
+            matrix = timeit.timeit(
+                lambda: [permission_matrix.allowed(user, a) for a in actions],
+                number=args.calls // len(actions))
+            # Ответы User.can запоминаются на экземпляре, поэтому здесь
+            # измеряется уже чтение из памяти запроса
+            memo = timeit.timeit(
+                lambda: [user.can(a) for a in actions],
+                number=args.calls // len(actions))
+            results.append({
+                'role': role,
+                'legacy_ns_per_call': legacy / args.calls * 1e9,
+                'matrix_ns_per_call': matrix / args.calls * 1e9,
+                'request_memo_ns_per_call': memo / args.calls * 1e9,
+            })
+    write_result('permissions', {
+        'calls': args.calls,
+        'roles': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
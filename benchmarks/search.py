@@ -0,0 +1,107 @@
+"""Бенчмарк поиска. По умолчанию измеряется только индекс в памяти
+(InvertedIndex.search_ids) на синтетическом каталоге: время построения
+и задержка запросов, база не используется. С флагом --database
+запросы идут через search_index приложения к базе из config.py
+(на MySQL - полнотекстовый индекс), данные готовит generate_data.py.
+Запуск из корня:
+
+    python benchmarks/search.py --books 100000 --queries 1000
+    python benchmarks/search.py --database --queries 1000
+"""
+import argparse
+import random
+import time
+
+from common import app, percentiles, write_result
+from search import InvertedIndex, search_index
+
+WORDS = ['война', 'мир', 'море', 'ночь', 'город', 'дом', 'сад', 'путь',
+         'свет', 'тень', 'зима', 'лето', 'река', 'огонь', 'ветер', 'звезда',
+         'время', 'память', 'сон', 'берег', 'история', 'тайна', 'остров']
+AUTHORS = ['Толстой', 'Чехов', 'Пушкин', 'Гоголь', 'Булгаков', 'Бунин',
+           'Тургенев', 'Лермонтов', 'Куприн', 'Платонов']
+GENRES = ['Роман', 'Повесть', 'Поэзия', 'Фантастика', 'Детектив']
+
+
+def make_documents(count, rng):
+    for book_id in range(1, count + 1):
+        yield book_id, {
+            'name': ' '.join(rng.sample(WORDS, 3)) + ' %d' % book_id,
+            'author': rng.choice(AUTHORS),
+            'publisher': 'Издательство %d' % rng.randint(1, 50),
+            'short_desc': ' '.join(rng.choices(WORDS, k=30)),
+            'genres': ' '.join(rng.sample(GENRES, 2)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', action='store_true',
+                        help='искать через search_index по базе приложения')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    queries = make_queries(args.queries, rng)
+    if args.database:
+        result = measure_database(queries)
+    else:
+        result = measure_memory(queries, args.books, rng)
+    result['seed'] = args.seed
+    write_result('search', result, args.output)
+
+
+def make_queries(count, rng):
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(rng.choice(WORDS))
+        elif kind < 0.7:
+            queries.append('%s %s' % (rng.choice(AUTHORS), rng.choice(WORDS)))
+        else:
+            # Префикс последнего слова, как при наборе в строке поиска
+            queries.append(rng.choice(WORDS)[:3])
+    return queries
+
+
+def measure_memory(queries, books, rng):
+    index = InvertedIndex()
+    started = time.perf_counter()
+    index.build(make_documents(books, rng))
+    build_seconds = time.perf_counter() - started
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search_ids(query, 50)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'backend': index.name,
+        'books': books,
+        'build_seconds': build_seconds,
+        'terms': len(index._postings),
+        'queries': percentiles(timings),
+    }
+
+
+# Полный путь поиска: запрос к базе (или построение индекса в памяти
+# при первом поиске) и ранжирование
+def measure_database(queries):
+    timings = []
+    with app.app_context():
+        for query in queries:
+            started = time.perf_counter()
+            search_index.search(query, 50)
+            timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'backend': search_index.name,
+        'first_query_ms': timings[0],
+        'queries': percentiles(timings),
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Пиковый RSS при сохранении обложки: потоковая запись против чтения целиком.
+
+Каждое измерение идет в отдельном интерпретаторе, чтобы ru_maxrss
+отражал только одну загрузку. Запуск из корня репозитория:
+
+    python benchmarks/upload_memory.py --sizes 8 32 128
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+# Путь до импорта common: он меняет текущий каталог
+SCRIPT = os.path.abspath(__file__)
+
+from common import write_result  # noqa: E402
+from tool import stream_to_file  # noqa: E402
+
+
+class GeneratedStream:
+    """Файлоподобный поток на size байт, не держащий их в памяти."""
+
+    def __init__(self, size):
+        self.remaining = size
+        self.block = os.urandom(1024 * 1024)
+
+    def read(self, n=-1):
+        if self.remaining <= 0:
+            return b''
+        if n < 0:
+            n = self.remaining
+        n = min(n, self.remaining)
+        self.remaining -= n
+        return (self.block * (n // len(self.block) + 1))[:n]
+
+
+def child(size, mode):
+    stream = GeneratedStream(size)
+    folder = tempfile.mkdtemp()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if mode == 'stream':
+        path, _, _ = stream_to_file(stream, folder)
+    else:
+        # Прежний путь: чтение целиком ради хеша, затем запись
+        data = stream.read()
+        hashlib.md5(data).hexdigest()
+        path = os.path.join(folder, 'cover')
+        with open(path, 'wb') as out:
+            out.write(data)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    os.remove(path)
+    print(json.dumps({'mode': mode, 'size_mb': size // (1024 * 1024),
+                      'peak_rss_kb': peak, 'growth_kb': peak - baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8, 32, 128],
+                        help='размеры загрузок в МиБ')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    if args.child:
+        child(int(args.child[0]), args.child[1])
+        return
+    results = []
+    for size in args.sizes:
+        for mode in ('buffered', 'stream'):
+            out = subprocess.run(
+                [sys.executable, SCRIPT, '--child',
+                 str(size * 1024 * 1024), mode],
+                check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+    write_result('upload_memory', {'uploads': results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
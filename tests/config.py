@@ -0,0 +1,18 @@
+# Настройки приложения для тестов: временная база SQLite и каталог
+# обложек, кеш фрагментов выключен, чтобы считать запросы страниц
+import os
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix='webdev-exam-tests-')
+
+SECRET_KEY = 'tests'
+SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(TEST_DIR, 'test.db')
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+UPLOAD_FOLDER = os.path.join(TEST_DIR, 'uploads')
+PER_PAGE = 10
+LOGS_PER_PAGE = 10
+ADMIN_ROLE_ID = 1
+MODERATOR_ROLE_ID = 2
+USER_ROLE_ID = 3
+
+FRAGMENT_CACHE_ENABLED = False
@@ -0,0 +1,88 @@
+import os
+import random
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Тесты всегда работают со своей временной базой
+os.environ['APP_CONFIG'] = os.path.join(TESTS_DIR, 'config.py')
+# Подключение приложения и заполнение базы общие с бенчмарками
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'benchmarks'))
+
+import sqlalchemy as sa  # noqa: E402
+
+from common import app, db, BENCH_PASSWORD, ADMIN_LOGIN  # noqa: E402
+import generate_data  # noqa: E402
+from models import User  # noqa: E402
+from ratings import rebuild_ratings  # noqa: E402
+from stats import rebuild_daily_visits, rebuild_visit_totals  # noqa: E402
+
+
+# Небольшая база с тем же распределением данных, что и у бенчмарков
+@pytest.fixture(scope='session')
+def seeded():
+    rng = random.Random(1)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate_data.ensure_roles()
+        genre_ids = generate_data.ensure_genres()
+        image_id = generate_data.ensure_cover()
+        user_ids = generate_data.generate_users(rng, 30, 1000)
+        book_ids = generate_data.generate_books(rng, 60, genre_ids, image_id,
+                                                1000)
+        generate_data.generate_reviews(rng, 200, book_ids, user_ids, 2.0, 1000)
+        generate_data.generate_visits(rng, 3000, book_ids, user_ids, 30, 2.0,
+                                      1000)
+        generate_data.generate_history(rng, book_ids, user_ids, 5, 2.0, 1000)
+        rebuild_ratings()
+        rebuild_daily_visits()
+        rebuild_visit_totals()
+        db.session.remove()
+    return {'book_ids': book_ids, 'user_ids': user_ids}
+
+
+@pytest.fixture
+def client(seeded):
+    return app.test_client()
+
+
+@pytest.fixture
+def login():
+    # Без user_id входит администратор
+    def login(client, user_id=None):
+        name = ADMIN_LOGIN
+        if user_id is not None:
+            with app.app_context():
+                name = db.session.get(User, user_id).login
+        response = client.post('/auth/login', data={
+            'login': name, 'password': BENCH_PASSWORD})
+        assert response.status_code == 302
+        return client
+    return login
+
+
+# Список SQL-запросов, выполненных внутри блока
+@contextmanager
+def recorded_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    sa.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute',
+                        before_cursor_execute)
+
+
+@pytest.fixture
+def queries():
+    return recorded_queries
@@ -0,0 +1,29 @@
+import pytest
+
+from common import app
+from fragments import fragment_cache
+
+
+@pytest.fixture
+def no_fragment_cache(monkeypatch):
+    # Считаются запросы самой отрисовки каталога, а не чтение из кеша
+    monkeypatch.setattr(fragment_cache, 'enabled', False)
+
+
+def catalog_queries(client, queries, url):
+    assert client.get(url).status_code == 200
+    with queries() as statements:
+        assert client.get(url).status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize('url', ['/', '/?page=2'])
+def test_catalog_queries_do_not_depend_on_page_size(
+        client, queries, monkeypatch, no_fragment_cache, url):
+    counts = []
+    for per_page in (3, 20):
+        monkeypatch.setitem(app.config, 'PER_PAGE', per_page)
+        counts.append(catalog_queries(client, queries, url))
+    # Популярные книги и страница каталога: книги с обложками
+    # и жанры страницы одним запросом
+    assert counts == [4, 4]
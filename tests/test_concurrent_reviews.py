@@ -0,0 +1,58 @@
+import random
+import threading
+
+import sqlalchemy as sa
+
+from common import app, db
+from models import Book, Review, RATING_VALUES
+
+
+def book_counters(book_id):
+    book = db.session.get(Book, book_id)
+    db.session.refresh(book)
+    return (book.rating_sum, book.rating_num,
+            [getattr(book, 'rating_%d' % value) for value in RATING_VALUES])
+
+
+def counters_from_reviews(book_id):
+    ratings = db.session.scalars(
+        sa.select(Review.rating).where(Review.book_id == book_id)).all()
+    return (sum(ratings), len(ratings),
+            [ratings.count(value) for value in RATING_VALUES])
+
+
+# Параллельные рецензии разных пользователей через reviews.new, каждый
+# пользователь отправляет форму дважды: повторная рецензия должна
+# отсекаться уникальным ключом до изменения рейтинга книги
+def test_parallel_reviews_keep_rating_consistent(login, seeded):
+    book_id = seeded['book_ids'][len(seeded['book_ids']) // 2]
+    rng = random.Random(1)
+    clients = []
+    for user_id in seeded['user_ids'][:12]:
+        client = login(app.test_client(), user_id)
+        rating = rng.choice(RATING_VALUES)
+        clients += [(client, rating), (client, rating)]
+    barrier = threading.Barrier(len(clients))
+    statuses = []
+
+    def post(client, rating):
+        barrier.wait()
+        response = client.post('/reviews/%d/new' % book_id,
+                               data={'rating': rating, 'text': 'Отзыв'})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post, args=item) for item in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(statuses) == len(clients)
+    assert set(statuses) <= {200, 302}
+    with app.app_context():
+        expected = counters_from_reviews(book_id)
+        assert book_counters(book_id) == expected
+        reviewers = db.session.scalars(
+            sa.select(Review.user_id).where(Review.book_id == book_id)).all()
+        assert len(reviewers) == len(set(reviewers))
+        assert set(seeded['user_ids'][:12]) <= set(reviewers)
@@ -0,0 +1,43 @@
+import sqlalchemy as sa
+
+from common import app, db
+from loaders import BookLoader
+from models import Book, Review, BookVisits
+
+
+def create_book(seeded):
+    source = db.session.get(Book, seeded['book_ids'][0])
+    book = Book(name='Книга для удаления', short_desc='Описание',
+                year_release=2000, publisher='Издательство', author='Автор',
+                pages_volume=100, image_id=source.image_id)
+    db.session.add(book)
+    db.session.flush()
+    user_id = seeded['user_ids'][0]
+    db.session.add(Review(book_id=book.id, user_id=user_id, rating=4,
+                          text='Рецензия'))
+    db.session.add_all(BookVisits(book_id=book.id, user_id=user_id)
+                       for _ in range(7))
+    db.session.commit()
+    return book.id
+
+
+# Удаление, прерванное перезапуском: отметка в базе прячет книгу
+# во всех процессах, а resume-purges удаляет ее вместе с зависимостями
+def test_interrupted_purge_is_hidden_and_resumed(client, seeded):
+    with app.app_context():
+        book_id = create_book(seeded)
+        db.session.execute(sa.update(Book).where(Book.id == book_id)
+                           .values(purging=True))
+        db.session.commit()
+    assert client.get('/%d' % book_id).status_code == 404
+    with app.test_request_context():
+        assert BookLoader().load_many([book_id]) == []
+
+    result = app.test_cli_runner().invoke(args=['resume-purges'])
+    assert result.exit_code == 0, result.output
+    assert 'Удалено книг: 1, с ошибкой: 0' in result.output
+    with app.app_context():
+        assert db.session.get(Book, book_id) is None
+        for model in (Review, BookVisits):
+            assert (db.session.query(model)
+                    .filter(model.book_id == book_id).count() == 0)
@@ -0,0 +1,103 @@
+import re
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from common import app, db
+from history import last_book_ids
+from purge import count_image_references
+from visit_cap import visit_cap
+
+USED_INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+
+def plan(statement, parameters):
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement,
+                                    parameters).all()
+    return [row[-1] for row in rows]
+
+
+# Имя индекса в SQLite: уникальные ограничения становятся индексами
+# sqlite_autoindex_*, их находим по набору столбцов
+def sqlite_index(table, name):
+    constraint = next((c for c in db.metadata.tables[table].constraints
+                       if c.name == name), None)
+    if constraint is None:
+        return name
+    columns = [column.name for column in constraint.columns]
+    with db.engine.connect() as conn:
+        for row in conn.exec_driver_sql('PRAGMA index_list(%s)' % table):
+            index_columns = [info[2] for info in conn.exec_driver_sql(
+                'PRAGMA index_info(%s)' % row[1])]
+            if index_columns == columns:
+                return row[1]
+    raise AssertionError('нет индекса для %s' % name)
+
+
+def assert_uses_index(statements, fragment, table, name):
+    matching = [item for item in statements if fragment in item[0]]
+    assert matching, 'запрос с "%s" не выполнялся' % fragment
+    details = plan(*matching[0])
+    used = {index for detail in details
+            for index in USED_INDEX_RE.findall(detail)}
+    assert sqlite_index(table, name) in used, details
+
+
+@pytest.fixture
+def statements(seeded):
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        captured.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    sa.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield captured
+    sa.event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_visit_cap_count(statements, seeded):
+    with app.app_context():
+        visit_cap._count_in_db(seeded['user_ids'][0], seeded['book_ids'][0],
+                               time.time())
+        assert_uses_index(statements, 'FROM book_visits', 'book_visits',
+                          'ix_book_visits_book_id_user_id_created_at')
+
+
+def test_last_visits(statements, seeded):
+    with app.app_context():
+        last_book_ids(seeded['user_ids'][0], 5)
+        assert_uses_index(statements, 'FROM last_book_visits',
+                          'last_book_visits',
+                          'ix_last_book_visits_user_id_created_at')
+
+
+def test_review_lookup(client, login, statements, seeded):
+    login(client, seeded['user_ids'][0])
+    client.get('/reviews/%d/new' % seeded['book_ids'][-1])
+    with app.app_context():
+        assert_uses_index(statements, 'FROM reviews', 'reviews',
+                          'uq_reviews_book_id_user_id')
+
+
+def test_image_references(statements):
+    with app.app_context():
+        count_image_references('bench-cover')
+        assert_uses_index(statements, 'books.image_id', 'books',
+                          'ix_books_image_id')
+
+
+def test_visit_log_keyset_page(client, login, statements):
+    login(client)
+    page = client.get('/logs/users_statistics?page=5').data.decode()
+    cursor = re.search(r'cursor=([\w-]+)', page).group(1)
+    statements.clear()
+    assert client.get('/logs/users_statistics?cursor=' + cursor
+                      ).status_code == 200
+    with app.app_context():
+        assert_uses_index(statements, 'FROM book_visits ', 'book_visits',
+                          'ix_book_visits_created_at_id')
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+
+from common import app, db
+import fragments
+from models import Review
+from routing import STICKY_KEY
+
+REPLICA_PREFIX = 'Реплика '
+
+
+def sticky(client):
+    with client.session_transaction() as session:
+        return STICKY_KEY in session
+
+
+# Журнал просмотров и история пишутся при каждом просмотре книги,
+# но не закрепляют читателя за основной базой
+def test_viewing_a_book_does_not_pin_to_primary(client, login, seeded):
+    book_id = seeded['book_ids'][0]
+    assert client.get('/%d' % book_id).status_code == 200
+    assert not sticky(client)
+    login(client, seeded['user_ids'][1])
+    # Вход переносит историю из cookie в базу и закрепляет сам
+    with client.session_transaction() as session:
+        session.pop(STICKY_KEY, None)
+    assert client.get('/%d' % book_id).status_code == 200
+    assert not sticky(client)
+
+
+def test_review_pins_to_primary(client, login, seeded):
+    login(client, seeded['user_ids'][2])
+    client.post('/reviews/%d/new' % seeded['book_ids'][-2],
+                data={'rating': 4, 'text': 'Отзыв'})
+    assert sticky(client)
+
+
+# Реплика - отдельный файл с копией основной базы, в котором у книг
+# другие названия: по ответу видно, из какой базы он прочитан
+@pytest.fixture
+def replica(seeded, monkeypatch):
+    with app.app_context():
+        primary = db.engine.url.database
+        db.session.remove()
+    path = os.path.join(os.path.dirname(primary), 'replica.db')
+    source, target = sqlite3.connect(primary), sqlite3.connect(path)
+    with target:
+        source.backup(target)
+        target.execute("UPDATE books SET name = ? || name",
+                       (REPLICA_PREFIX,))
+    source.close()
+    target.close()
+    url = 'sqlite:///' + path
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', {'replica': url})
+    with app.app_context():
+        engine = sa.create_engine(url)
+        monkeypatch.setitem(db.engines, 'replica', engine)
+    # Свежий процесс: каталог в нем еще не менялся
+    monkeypatch.setattr(fragments.fragment_cache, 'backend',
+                        fragments.LocalFragmentBackend(100))
+    yield engine
+    engine.dispose()
+    os.remove(path)
+
+
+def admin_client(login):
+    client = login(app.test_client())
+    with client.session_transaction() as session:
+        session.pop(STICKY_KEY, None)
+    return client
+
+
+def test_reports_and_catalog_read_from_replica(replica, login):
+    client = admin_client(login)
+    for url in ('/logs/books_statistics', '/logs/users_statistics',
+                '/logs/export/books.csv', '/logs/export/visits.csv', '/'):
+        response = client.get(url)
+        assert response.status_code == 200, url
+        assert REPLICA_PREFIX in response.get_data(as_text=True), url
+    assert not sticky(client)
+
+
+def test_book_page_and_writes_use_primary(replica, login, seeded):
+    client = admin_client(login)
+    book_id = seeded['book_ids'][3]
+    response = client.get('/%d' % book_id)
+    assert response.status_code == 200
+    assert REPLICA_PREFIX not in response.get_data(as_text=True)
+
+    client.post('/reviews/%d/new' % book_id,
+                data={'rating': 5, 'text': 'Отзыв для основной базы'})
+    with app.app_context():
+        assert (Review.query.filter_by(text='Отзыв для основной базы')
+                .count() == 1)
+    with replica.connect() as conn:
+        assert conn.execute(
+            sa.select(sa.func.count()).select_from(Review.__table__)
+            .where(Review.text == 'Отзыв для основной базы')).scalar() == 0
+
+    # После своей записи пользователь читает отчеты с основной базы
+    assert sticky(client)
+    for url in ('/logs/books_statistics', '/'):
+        response = client.get(url)
+        assert response.status_code == 200, url
+        assert REPLICA_PREFIX not in response.get_data(as_text=True), url
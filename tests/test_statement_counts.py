@@ -0,0 +1,40 @@
+# Число SQL-запросов на страницу не должно зависеть от числа книг
+# в списках: книги загружаются одним пакетом на запрос
+
+
+def get_counted(client, queries, url):
+    # Первый запрос заполняет кеши процесса (пользователь, популярные
+    # книги, число книг в каталоге), считается второй
+    assert client.get(url).status_code == 200
+    with queries() as statements:
+        assert client.get(url).status_code == 200
+    return len(statements)
+
+
+def test_index_anonymous(client, queries):
+    # Популярные книги и страница каталога: книги и их жанры
+    assert get_counted(client, queries, '/') == 4
+
+
+def test_index_with_recently_viewed(client, login, queries, seeded):
+    login(client, seeded['user_ids'][0])
+    # История пользователя, ее книги и жанры, популярные книги
+    # и каталог
+    assert get_counted(client, queries, '/') == 7
+
+
+def test_recently_viewed_does_not_depend_on_history_size(client, queries,
+                                                          seeded):
+    # Редко просматриваемые книги, которых нет среди популярных
+    book_ids = seeded['book_ids'][-5:]
+    client.get('/%d' % book_ids[0])
+    one_book = get_counted(client, queries, '/')
+    for book_id in book_ids[1:]:
+        client.get('/%d' % book_id)
+    assert get_counted(client, queries, '/') == one_book == 6
+
+
+def test_books_statistics(client, login, queries):
+    login(client)
+    # Страница итогов вместе с книгами одним запросом
+    assert get_counted(client, queries, '/logs/books_statistics') == 1
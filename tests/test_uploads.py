@@ -0,0 +1,49 @@
+import io
+import os
+import stat
+
+from common import app
+from files import FILE_MODE
+from models import Book
+
+
+def test_uploaded_cover_is_readable_by_other_users(client, login):
+    login(client)
+    response = client.post('/new', content_type='multipart/form-data', data={
+        'name': 'Книга с новой обложкой', 'author': 'Автор',
+        'publisher': 'Издательство', 'year_release': '2001',
+        'pages_volume': '100', 'short_desc': 'Описание',
+        'background_img': (io.BytesIO(b'cover for mode check'), 'cover.png'),
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        book = Book.query.filter_by(name='Книга с новой обложкой').one()
+        path = os.path.join(app.config['UPLOAD_FOLDER'],
+                            book.image.file_name)
+    # Обложку отдает фронтовой прокси под своим пользователем
+    assert stat.S_IMODE(os.stat(path).st_mode) == FILE_MODE
+
+
+def test_upload_survives_broken_thumbnail_pool(client, login, monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+    import thumbnails
+
+    class BrokenPool:
+        def submit(self, *args):
+            raise BrokenProcessPool('worker died')
+
+        def shutdown(self, wait=True):
+            pass
+
+    monkeypatch.setattr(thumbnails.thumbnails, '_pool', BrokenPool())
+    login(client)
+    response = client.post('/new', content_type='multipart/form-data', data={
+        'name': 'Книга при сломанном пуле', 'author': 'Автор',
+        'publisher': 'Издательство', 'year_release': '2002',
+        'pages_volume': '100', 'short_desc': 'Описание',
+        'background_img': (io.BytesIO(b'cover for broken pool'), 'cover.png'),
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        assert Book.query.filter_by(name='Книга при сломанном пуле').count() == 1
+    assert thumbnails.thumbnails._pool is None